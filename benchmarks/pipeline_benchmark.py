@@ -0,0 +1,436 @@
+import argparse
+import io
+import json
+import os
+import platform
+import socket
+import struct
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+SERVICE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "service")
+NETWORK = "pruminx_benchmark"
+NGINX_CONTAINER = "nginx"
+
+class FakeDockerEngine:
+    # Answers the docker engine API calls of the service, every container is running and connected to the network
+    def __init__(self, containers: list[str], latency: float = 0.0):
+        self.latency = latency
+        self.archived_bytes = 0
+        # Files copied into the containers by name, and the exit code of nginx -t
+        self.files = {}
+        self.nginx_test_exit_code = 0
+        self.execs = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.names = [NGINX_CONTAINER, *containers]
+        self.containers = {f"{index:064x}": name for index, name in enumerate(self.names, 1)}
+        self.by_name = {name: id for id, name in self.containers.items()}
+        self.calls = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.base_url = "tcp://127.0.0.1:%d" % self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-docker", daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+    def _summary(self, id: str):
+        return {
+            "Id": id,
+            "Names": ["/" + self.containers[id]],
+            "State": "running",
+            "Labels": {},
+            "NetworkSettings": {"Networks": {NETWORK: {}}},
+        }
+
+    def _inspect(self, id: str):
+        return {
+            "Id": id,
+            "Name": "/" + self.containers[id],
+            "State": {"Status": "running", "Running": True, "StartedAt": "2024-01-01T00:00:00Z"},
+            "Config": {"Labels": {}},
+            "NetworkSettings": {"Networks": {NETWORK: {}}},
+        }
+
+    def _find(self, key: str):
+        if key in self.containers:
+            return key
+        return self.by_name.get(key)
+
+    def _handler(self):
+        engine = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body=None):
+                data = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _route(self, method: str):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                with engine._lock:
+                    engine.in_flight += 1
+                    engine.max_in_flight = max(engine.max_in_flight, engine.in_flight)
+                try:
+                    if engine.latency:
+                        time.sleep(engine.latency)
+                finally:
+                    with engine._lock:
+                        engine.in_flight -= 1
+                path = urlsplit(self.path).path
+                parts = path.strip("/").split("/")
+                # The docker SDK prefixes the paths with the API version, the async client does not
+                if parts[0].startswith("v1."):
+                    parts = parts[1:]
+                if parts == ["containers", "json"]:
+                    call = f"{method} /containers/json"
+                else:
+                    call = f"{method} /{parts[0]}" + ("/{id}/" + "/".join(parts[2:]) if len(parts) > 2 else "/{id}" if len(parts) == 2 else "")
+                with engine._lock:
+                    engine.calls[call] = engine.calls.get(call, 0) + 1
+                if parts == ["version"] or parts == ["_ping"]:
+                    return self._send(200, {"ApiVersion": "1.43", "Version": "24.0.0"})
+                if parts[0] == "networks" and len(parts) == 2:
+                    containers = {id: {"Name": name} for id, name in engine.containers.items()}
+                    return self._send(200, {"Id": NETWORK, "Name": NETWORK, "Containers": containers})
+                if parts[0] == "networks":
+                    return self._send(200, {})
+                if parts == ["containers", "json"]:
+                    return self._send(200, [engine._summary(id) for id in engine.containers])
+                if parts[0] == "containers" and len(parts) == 3:
+                    id = engine._find(parts[1])
+                    if id is None:
+                        return self._send(404, {"message": f"No such container: {parts[1]}"})
+                    if parts[2] == "json":
+                        return self._send(200, engine._inspect(id))
+                    if parts[2] == "archive" and method == "PUT":
+                        with tarfile.open(fileobj=io.BytesIO(body)) as tar, engine._lock:
+                            engine.archived_bytes += len(body)
+                            engine.files.update({member.name: tar.extractfile(member).read() for member in tar if member.isfile()})
+                        return self._send(200)
+                    if parts[2] == "archive":
+                        return self._send_archive(parse_qs(urlsplit(self.path).query).get("path", [""])[0])
+                    if parts[2] == "restart":
+                        return self._send(204)
+                    if parts[2] == "exec":
+                        with engine._lock:
+                            exec_id = f"{len(engine.execs) + 1:064x}"
+                            engine.execs[exec_id] = json.loads(body or b"{}").get("Cmd") or []
+                        return self._send(201, {"Id": exec_id})
+                if parts[0] == "exec" and len(parts) == 3:
+                    cmd = engine.execs.get(parts[1], [])
+                    if parts[2] == "json":
+                        exit_code = engine.nginx_test_exit_code if cmd == ["nginx", "-t"] else 0
+                        return self._send(200, {"ExitCode": exit_code, "Running": False})
+                    if cmd[:2] == ["rm", "-f"]:
+                        with engine._lock:
+                            for path in cmd[2:]:
+                                engine.files.pop(path.rsplit("/", 1)[-1], None)
+                    # Stream framed as docker does without a tty, the connection ends with the output
+                    output = b"nginx: configuration file /etc/nginx/nginx.conf test is successful\n"
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    self.wfile.write(struct.pack(">BxxxI", 2, len(output)) + output)
+                    self.close_connection = True
+                    return
+                self._send(404, {"message": f"Not implemented in the fake engine: {method} {path}"})
+
+            def _send_archive(self, path: str):
+                # The container has a single folder with the copied files
+                name = path.rstrip("/").rsplit("/", 1)[-1]
+                with engine._lock:
+                    files = {name: engine.files[name]} if name in engine.files else None
+                    if files is None and path.endswith("/"):
+                        files = {f"{name}/{file_name}": data for file_name, data in engine.files.items()}
+                if files is None:
+                    return self._send(404, {"message": f"Could not find the file {path} in container"})
+                buffer = io.BytesIO()
+                with tarfile.open(fileobj=buffer, mode="w") as tar:
+                    for file_name, data in files.items():
+                        info = tarfile.TarInfo(file_name)
+                        info.size = len(data)
+                        tar.addfile(info, io.BytesIO(data))
+                data = buffer.getvalue()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-tar")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._route("GET")
+
+            def do_POST(self):
+                self._route("POST")
+
+            def do_PUT(self):
+                self._route("PUT")
+
+        return Handler
+
+def summarize(timings: list[float]):
+    timings = sorted(timings)
+    if not timings:
+        return {}
+    return {
+        "count": len(timings),
+        "min_ms": timings[0] * 1000,
+        "mean_ms": sum(timings) / len(timings) * 1000,
+        "p50_ms": timings[int(len(timings) * 0.5)] * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        "p99_ms": timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+        "max_ms": timings[-1] * 1000,
+    }
+
+def measure(call, rounds: int):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+def load(base_url: str, path: str, clients: int, requests: int):
+    import httpx
+
+    def client_run(_):
+        timings = []
+        with httpx.Client(base_url=base_url, timeout=300) as client:
+            for _ in range(requests):
+                start = time.perf_counter()
+                client.get(path).raise_for_status()
+                timings.append(time.perf_counter() - start)
+        return timings
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        timings = [timing for result in pool.map(client_run, range(clients)) for timing in result]
+    elapsed = time.perf_counter() - start
+    return {"clients": clients, "requests": len(timings), "seconds": elapsed, "requests_per_second": len(timings) / elapsed, **summarize(timings)}
+
+def write_config(directory: str, base_url: str, nodes: list[str] = []):
+    import yaml
+    config = {
+        "docker": {"base_url": base_url, "network": NETWORK, "watch_events": False},
+        "nginx": {
+            "container_id": NGINX_CONTAINER,
+            "static_path": "/config/",
+            "config_path": os.path.join(directory, "nginx_conf") + "/",
+            "docker_config_file": "dockers.conf",
+            "config_warn_message": "# Generated by the pipeline benchmark",
+            "private_key_path": "/etc/nginx/ssl/private.key",
+            "certificate_path": "/etc/nginx/ssl/certificate.crt",
+            "letsencrypt_path": "/etc/letsencrypt/live/",
+            "reload_mode": "reload",
+            "push_delay": 0,
+            "nodes": [{"name": f"node{index}", "base_url": node_url, "container_id": NGINX_CONTAINER} for index, node_url in enumerate(nodes)],
+        },
+    }
+    os.makedirs(config["nginx"]["config_path"])
+    with open(os.path.join(directory, "config.yaml"), "w") as f:
+        yaml.safe_dump(config, f)
+
+def run_size(routes: int, domains: int, containers: int, rounds: int, clients: int, requests: int, nodes: int = 0,
+             node_latency: float = 0.0):
+    # Runs in its own process and temporary directory, the service reads config.yaml and the database from the cwd.
+    # The directory, with the database and the rendered configs, is removed at the end
+    with tempfile.TemporaryDirectory(prefix="pruminx-benchmark-") as directory:
+        try:
+            return _run_size(directory, routes, domains, containers, rounds, clients, requests, nodes, node_latency)
+        finally:
+            os.chdir(tempfile.gettempdir())
+            if "main" in sys.modules:
+                sys.modules["main"].db.close()
+
+def _run_size(directory: str, routes: int, domains: int, containers: int, rounds: int, clients: int, requests: int,
+              nodes: int, node_latency: float):
+    import httpx
+    import uvicorn
+
+    engine = FakeDockerEngine([f"container{index}" for index in range(containers)])
+    engine.start()
+    # Every node is an engine of its own, the slowest one waits node_latency per call
+    node_engines = [FakeDockerEngine([], node_latency * (index + 1) / nodes) for index in range(nodes)]
+    for node_engine in node_engines:
+        node_engine.start()
+    write_config(directory, engine.base_url, [node_engine.base_url for node_engine in node_engines])
+    os.chdir(directory)
+    os.environ["DOCKER_HOST"] = engine.base_url
+    sys.path.insert(0, SERVICE_PATH)
+    import main as service
+    from schema import NginxRoute, ProxyType
+
+    result = {"routes": routes, "domains": domains, "containers": containers, "nodes": nodes}
+    start = time.perf_counter()
+    batch = [
+        NginxRoute(
+            proxy_type=ProxyType.docker,
+            domain=f"domain{index % domains}.example.com",
+            path=f"/service{index}",
+            container_id=f"container{index % containers}",
+            port=8000 + index % 100,
+            target_path="/api" if index % 3 == 0 else "",
+            project_name=f"project{index % 50}",
+            description=f"benchmark service {index}",
+        )
+        for index in range(routes)
+    ]
+    with service.db.transaction():
+        service.db.add_missing_domain_custom_configs({f"domain{index}.example.com": "\n\tlisten 80;\n" for index in range(domains)})
+        service.db.add_routes(batch)
+    result["seed_seconds"] = time.perf_counter() - start
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(service.nginx_app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="uvicorn", daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    base_url = f"http://127.0.0.1:{port}"
+
+    def get(client: httpx.Client, path: str, **kwargs):
+        response = client.get(path, **kwargs)
+        response.raise_for_status()
+        return response
+
+    try:
+        with httpx.Client(base_url=base_url, timeout=600) as client:
+            # Keyed apart from "routes", which is the number of routes of the run
+            for name, path in (("list_routes", "/routes"), ("list_routes_by_domain", "/routes_by_domain")):
+                cold = measure(lambda: get(client, path), 1)
+                response = get(client, path)
+                etag = {"If-None-Match": response.headers["ETag"]}
+                result[name] = {
+                    "cold": cold,
+                    "warm": measure(lambda: get(client, path), rounds),
+                    "not_modified": measure(lambda: client.get(path, headers=etag), rounds),
+                    "bytes": len(response.content),
+                }
+            result["routes_page"] = measure(lambda: get(client, "/routes", params={"domain_prefix": "domain1", "limit": 100}), rounds)
+            result["routes_search"] = measure(lambda: get(client, "/routes", params={"q": "service", "limit": 100}), rounds)
+
+            result["verify_dockers"] = measure(lambda: client.post("/verify_dockers").raise_for_status(), rounds)
+
+            def push():
+                job = client.post("/update_nginx_config", params={"wait": True}).raise_for_status().json()["job"]
+                return job
+
+            start = time.perf_counter()
+            job = push()
+            result["update_nginx_config"] = {
+                "full": {"seconds": time.perf_counter() - start, "files": len(job["result"]["files"]), "push_ms": job["duration_ms"]},
+                "unchanged": measure(push, rounds),
+            }
+            route = get(client, "/routes", params={"limit": 1}).json()["routes"][0]
+
+            def change_and_push():
+                route["description"] = f"changed {time.perf_counter()}"
+                route["port"] = route["port"] % 100 + 8001
+                client.put(f"/route/{route['id']}", json=route).raise_for_status()
+                push()
+            result["update_nginx_config"]["one_route"] = measure(change_and_push, rounds)
+
+        result["load"] = {
+            "routes": load(base_url, "/routes", clients, requests),
+            "routes_by_domain": load(base_url, "/routes_by_domain", clients, requests),
+            "routes_page": load(base_url, "/routes?domain_prefix=domain1&limit=100", clients, requests),
+        }
+        result["docker_engine_calls"] = dict(sorted(engine.calls.items()))
+        if node_engines:
+            result["node_archived_bytes"] = {f"node{index}": node_engine.archived_bytes for index, node_engine in enumerate(node_engines)}
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+        engine.stop()
+        for node_engine in node_engines:
+            node_engine.stop()
+    return result
+
+def get_environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=SERVICE_PATH).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the service endpoints end to end against a fake docker engine")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma separated numbers of routes, one run each")
+    parser.add_argument("--routes-per-domain", type=int, default=10)
+    parser.add_argument("--routes-per-container", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=20, help="Requests per client in the load tests")
+    parser.add_argument("--nodes", type=int, default=0, help="Nginx nodes receiving the pushes, each one a fake engine")
+    parser.add_argument("--node-latency", type=float, default=0.0, help="Seconds added to every call to the slowest node")
+    parser.add_argument("--output", help="JSON results file, printed when not given")
+    parser.add_argument("--run-size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    def options(routes: int):
+        return dict(
+            routes=routes,
+            domains=max(1, routes // args.routes_per_domain),
+            containers=max(1, routes // args.routes_per_container),
+            rounds=args.rounds,
+            clients=args.clients,
+            requests=args.requests,
+            nodes=args.nodes,
+            node_latency=args.node_latency,
+        )
+
+    if args.run_size:
+        print(json.dumps(run_size(**options(args.run_size))))
+        sys.exit(0)
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        print(f"Benchmarking {size} routes", file=sys.stderr)
+        # Every size runs in a fresh process, so the module level database and caches start empty
+        command = [sys.executable, os.path.abspath(__file__), "--run-size", str(size)]
+        command += ["--routes-per-domain", str(args.routes_per_domain), "--routes-per-container", str(args.routes_per_container)]
+        command += ["--rounds", str(args.rounds), "--clients", str(args.clients), "--requests", str(args.requests)]
+        command += ["--nodes", str(args.nodes), "--node-latency", str(args.node_latency)]
+        output = subprocess.run(command, capture_output=True, text=True)
+        if output.returncode:
+            print(output.stderr, file=sys.stderr)
+            results.append({"routes": size, "error": "\n".join(output.stderr.strip().splitlines()[-3:]) or "failed"})
+            continue
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    report = json.dumps({"environment": get_environment(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
@@ -0,0 +1,63 @@
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "service"))
+
+from nginx_config import config_lines, write_config_file
+from schema import NginxRoute, ProxyType
+
+def build_domains(domains: int, routes: int):
+    grouped = {}
+    for index in range(routes):
+        domain = f"domain{index % domains}.example.com"
+        if domain not in grouped:
+            grouped[domain] = {
+                "custom_config": config_lines(server_name=domain, ssl_certificate="/cert.pem", ssl_certificate_key="/key.pem"),
+                "routes": [],
+            }
+        grouped[domain]["routes"].append(NginxRoute(
+            proxy_type=ProxyType.docker,
+            domain=domain,
+            path=f"/service{index}",
+            container_id=f"container{index}",
+            port=8000 + index % 100,
+            target_path="/api" if index % 3 == 0 else "",
+            enabled=index % 10 != 0,
+            custom_config="proxy_read_timeout 60s;" if index % 5 == 0 else None,
+        ))
+    return grouped
+
+def run(domains: int, routes: int, rounds: int):
+    grouped = build_domains(domains, routes)
+    timings = []
+    size = 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        size = 0
+        for group in grouped.values():
+            buffer = io.StringIO()
+            write_config_file(buffer, group["custom_config"], group["routes"], "# warning")
+            size += len(buffer.getvalue())
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        "domains": domains,
+        "routes": routes,
+        "rounds": rounds,
+        "best_seconds": best,
+        "mean_seconds": sum(timings) / len(timings),
+        "routes_per_second": routes / best,
+        "bytes": size,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render nginx configs for synthetic routes and time it")
+    parser.add_argument("--domains", type=int, default=1000)
+    parser.add_argument("--routes", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.domains, args.routes, args.rounds), indent=2))
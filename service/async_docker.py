@@ -0,0 +1,88 @@
+import asyncio
+import os
+import struct
+import docker
+import httpx
+from schema import DockerConfig
+from metrics import DOCKER_ENGINE_SECONDS, instrument_methods
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+
+@instrument_methods(DOCKER_ENGINE_SECONDS, "call", exclude=("aclose",))
+class AsyncDockerClient:
+    def __init__(self, base_url: str, max_connections: int = 10, timeout: float = 30.0):
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        if base_url.startswith("unix://"):
+            transport = httpx.AsyncHTTPTransport(uds=base_url[len("unix://"):], limits=limits)
+            base_url = "http://docker"
+        else:
+            transport = httpx.AsyncHTTPTransport(limits=limits)
+            base_url = base_url.replace("tcp://", "http://", 1)
+        self.base_url = base_url
+        self._client = httpx.AsyncClient(base_url=base_url, transport=transport, timeout=timeout)
+        # Keeps slow engine calls from opening more connections than the engine is allowed to take
+        self._semaphore = asyncio.Semaphore(max_connections)
+
+    @classmethod
+    def from_config(cls, config: DockerConfig):
+        # Same precedence as DockerUtils: the environment first, then the configured URL
+        base_url = os.environ.get("DOCKER_HOST")
+        if not base_url and os.path.exists(DEFAULT_SOCKET):
+            base_url = "unix://" + DEFAULT_SOCKET
+        return cls(base_url or config.base_url, config.max_connections, config.timeout)
+
+    async def _request(self, method: str, path: str, **kwargs):
+        async with self._semaphore:
+            try:
+                response = await self._client.request(method, path, **kwargs)
+            except httpx.HTTPError as e:
+                raise docker.errors.DockerException(f"Error connecting to Docker: {e}")
+        if response.status_code == 404:
+            raise docker.errors.NotFound(response.text)
+        if response.status_code >= 400:
+            raise docker.errors.APIError(response.text)
+        return response
+
+    async def list_containers(self, all: bool = True):
+        return (await self._request("GET", "/containers/json", params={"all": int(all)})).json()
+
+    async def inspect_container(self, container_id: str):
+        return (await self._request("GET", f"/containers/{container_id}/json")).json()
+
+    async def inspect_network(self, network_id: str):
+        return (await self._request("GET", f"/networks/{network_id}")).json()
+
+    async def connect_network(self, network_id: str, container_id: str):
+        await self._request("POST", f"/networks/{network_id}/connect", json={"Container": container_id})
+
+    async def restart_container(self, container_id: str):
+        await self._request("POST", f"/containers/{container_id}/restart")
+
+    async def put_archive(self, container_id: str, path: str, data: bytes):
+        await self._request("PUT", f"/containers/{container_id}/archive", params={"path": path}, content=data,
+                            headers={"Content-Type": "application/x-tar"})
+
+    async def get_archive(self, container_id: str, path: str):
+        return (await self._request("GET", f"/containers/{container_id}/archive", params={"path": path})).content
+
+    async def exec_run(self, container_id: str, cmd: list[str]):
+        exec_id = (await self._request("POST", f"/containers/{container_id}/exec", json={
+            "Cmd": cmd, "AttachStdout": True, "AttachStderr": True,
+        })).json()["Id"]
+        raw = (await self._request("POST", f"/exec/{exec_id}/start", json={"Detach": False, "Tty": False})).content
+        exit_code = (await self._request("GET", f"/exec/{exec_id}/json")).json()["ExitCode"]
+        return exit_code, self._demultiplex(raw)
+
+    @staticmethod
+    def _demultiplex(raw: bytes):
+        # Without a tty stdout and stderr come in frames with an 8 bytes header: stream, 0, 0, 0, size
+        output = bytearray()
+        offset = 0
+        while offset + 8 <= len(raw):
+            size = struct.unpack(">I", raw[offset + 4:offset + 8])[0]
+            output += raw[offset + 8:offset + 8 + size]
+            offset += 8 + size
+        return bytes(output)
+
+    async def aclose(self):
+        await self._client.aclose()
@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+
+class ConfigWriter:
+    # Files are rendered into a staging directory next to the configs and moved into place with renames,
+    # so nginx never reads a half written file. The replaced files are kept to roll the generation back.
+    # A journal of the commit is written before the renames, a commit interrupted by a crash is rolled back
+    # when the writer is created again, so the folder never keeps files of two generations.
+    def __init__(self, config_path: str, staging_dir: str = ".pending", previous_dir: str = ".previous"):
+        self.config_path = config_path
+        self.staging_path = os.path.join(config_path, staging_dir)
+        self.previous_path = os.path.join(config_path, previous_dir)
+        self.journal_path = os.path.join(self.previous_path, "commit.json")
+        self.staged = {}
+        self.committed = {}
+        self.recover()
+
+    def recover(self):
+        # Returns the paths put back from a commit that did not finish
+        if not os.path.exists(self.journal_path):
+            return []
+        with open(self.journal_path) as f:
+            self.committed = json.load(f)
+        print(f"Rolling back an unfinished nginx config commit of {len(self.committed)} files")
+        return self.rollback()
+
+    def stage(self, config_file_path: str, config_data: str):
+        os.makedirs(self.staging_path, exist_ok=True)
+        staged_path = os.path.join(self.staging_path, os.path.basename(config_file_path))
+        with open(staged_path, "w") as f:
+            f.write(config_data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.staged[config_file_path] = staged_path
+
+    def stage_removal(self, config_file_path: str):
+        # The file is removed by the commit, and put back by its rollback
+        self.staged[config_file_path] = None
+
+    def discard(self):
+        for staged_path in self.staged.values():
+            if staged_path and os.path.exists(staged_path):
+                os.remove(staged_path)
+        self.staged = {}
+
+    def commit(self):
+        # Returns the paths of the files that were replaced or created
+        self.committed = {}
+        if not self.staged:
+            return []
+        shutil.rmtree(self.previous_path, ignore_errors=True)
+        os.makedirs(self.previous_path)
+        committed = {}
+        for config_file_path in self.staged:
+            previous_path = None
+            if os.path.exists(config_file_path):
+                previous_path = os.path.join(self.previous_path, os.path.basename(config_file_path))
+                try:
+                    # A hard link keeps the old content without copying it
+                    os.link(config_file_path, previous_path)
+                except OSError:
+                    shutil.copy2(config_file_path, previous_path)
+            committed[config_file_path] = previous_path
+        self._write_journal(committed)
+        # Set before the renames, a failure in the middle puts back the files already replaced
+        self.committed = committed
+        try:
+            for config_file_path, staged_path in self.staged.items():
+                if staged_path:
+                    os.replace(staged_path, config_file_path)
+                elif os.path.exists(config_file_path):
+                    os.remove(config_file_path)
+            self._fsync_dir(self.config_path)
+        except Exception:
+            self.rollback()
+            self.discard()
+            raise
+        os.remove(self.journal_path)
+        self.staged = {}
+        return list(committed)
+
+    def _write_journal(self, committed: dict[str, str | None]):
+        with open(self.journal_path, "w") as f:
+            json.dump(committed, f)
+            f.flush()
+            os.fsync(f.fileno())
+        self._fsync_dir(self.previous_path)
+
+    def rollback(self):
+        # Restores the files replaced by the last commit, returns their paths
+        for config_file_path, previous_path in self.committed.items():
+            if previous_path:
+                if os.path.exists(previous_path):
+                    os.replace(previous_path, config_file_path)
+            elif os.path.exists(config_file_path):
+                os.remove(config_file_path)
+        self._fsync_dir(self.config_path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        rolled_back = list(self.committed)
+        self.committed = {}
+        return rolled_back
+
+    @staticmethod
+    def _fsync_dir(path: str):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
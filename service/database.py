@@ -1,19 +1,192 @@
 import sqlite3
+import threading
 from contextlib import contextmanager
 from schema import NginxRoute, NginxRouteCreated, ProxyType
+from metrics import DB_QUERY_SECONDS, instrument_methods
 
+ROUTE_FIELDS = ("id", "domain", "path", "proxy_type", "container_id", "port", "target_path", "static_path", "enabled", "info", "description", "custom_config", "project_name", "contact_user",
+                "cache_zone", "cache_ttl", "gzip", "brotli", "expires", "proxy_buffering")
+# Columns added after the first version of the routes table, init_db adds them to older databases
+ROUTE_MIGRATIONS = {
+    "cache_zone": "TEXT",
+    "cache_ttl": "TEXT",
+    "gzip": "BOOLEAN",
+    "brotli": "BOOLEAN",
+    "expires": "TEXT",
+    "proxy_buffering": "BOOLEAN",
+}
+ROUTE_COLUMNS = ", ".join(ROUTE_FIELDS)
+INSERT_ROUTE_QUERY = f'''
+                INSERT INTO routes
+                ({", ".join(ROUTE_FIELDS[1:])})
+                VALUES ({", ".join("?" * len(ROUTE_FIELDS[1:]))})
+            '''
+UPDATE_ROUTE_QUERY = f'''
+                UPDATE routes SET {", ".join(field + " = ?" for field in ROUTE_FIELDS[1:])} WHERE id = ?
+            '''
+# Largest character, a prefix range [prefix, prefix + PREFIX_END) can use the indexes where LIKE can not
+PREFIX_END = "\U0010ffff"
+# External content index over the routes, kept in sync by triggers
+FTS_TABLE_QUERIES = (
+    '''
+        CREATE VIRTUAL TABLE routes_fts USING fts5(description, info, content='routes', content_rowid='id')
+    ''',
+    '''
+        CREATE TRIGGER routes_fts_insert AFTER INSERT ON routes BEGIN
+            INSERT INTO routes_fts (rowid, description, info) VALUES (new.id, new.description, new.info);
+        END
+    ''',
+    '''
+        CREATE TRIGGER routes_fts_delete AFTER DELETE ON routes BEGIN
+            INSERT INTO routes_fts (routes_fts, rowid, description, info) VALUES ('delete', old.id, old.description, old.info);
+        END
+    ''',
+    '''
+        CREATE TRIGGER routes_fts_update AFTER UPDATE OF description, info ON routes BEGIN
+            INSERT INTO routes_fts (routes_fts, rowid, description, info) VALUES ('delete', old.id, old.description, old.info);
+            INSERT INTO routes_fts (rowid, description, info) VALUES (new.id, new.description, new.info);
+        END
+    ''',
+    '''
+        INSERT INTO routes_fts (routes_fts) VALUES ('rebuild')
+    ''',
+)
+
+@instrument_methods(DB_QUERY_SECONDS, "method", exclude=("get_connection", "transaction", "pool_stats", "close"))
 class Database:
     def __init__(self, db_name="nginx_routes.db"):
         self.db_name = db_name
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._stats = {"opened": 0, "closed": 0, "checkouts": 0, "transactions": 0, "rollbacks": 0}
+        # Incremented on every commit, lets in-memory views of the tables know they are stale
+        self.generation = 0
+        self._route_cache = None
+        self._cache_lock = threading.Lock()
+        self.full_text_search = False
         self.init_db()
 
+    def _connect(self):
+        # Connections are only used by the thread that opened them, check_same_thread is
+        # disabled so the pool can close connections left behind by finished threads
+        conn = sqlite3.connect(self.db_name, timeout=30, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-16000")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _prune_connections(self, reused_ident: int | None = None):
+        alive = {thread.ident for thread in threading.enumerate()} - {reused_ident}
+        for ident in [ident for ident in self._connections if ident not in alive]:
+            self._connections.pop(ident).close()
+            self._stats["closed"] += 1
+
     @contextmanager
     def get_connection(self):
-        conn = sqlite3.connect(self.db_name)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.depth = 0
+            with self._lock:
+                # Thread idents can be reused, drop any connection registered by a finished thread with the same ident
+                self._prune_connections(threading.get_ident())
+                self._connections[threading.get_ident()] = conn
+                self._stats["opened"] += 1
+        with self._lock:
+            self._stats["checkouts"] += 1
         try:
             yield conn
-        finally:
-            conn.close()
+        except Exception:
+            # A failed statement outside transaction() must not leave its implicit transaction open
+            if not self._local.depth and conn.in_transaction:
+                conn.rollback()
+            raise
+
+    def _commit(self, conn: sqlite3.Connection):
+        # Inside a transaction() block the commit is deferred to the end of the block
+        if not self._local.depth:
+            conn.commit()
+            with self._lock:
+                self.generation += 1
+
+    @contextmanager
+    def transaction(self):
+        with self.get_connection() as conn:
+            self._local.depth += 1
+            try:
+                yield conn
+            except Exception:
+                self._local.depth -= 1
+                if not self._local.depth:
+                    conn.rollback()
+                    with self._lock:
+                        self._stats["rollbacks"] += 1
+                raise
+            self._local.depth -= 1
+            if not self._local.depth:
+                conn.commit()
+                with self._lock:
+                    self._stats["transactions"] += 1
+                    self.generation += 1
+
+    def pool_stats(self):
+        with self._lock:
+            self._prune_connections()
+            stats = dict(self._stats)
+            stats["connections"] = len(self._connections)
+        stats["reused"] = stats["checkouts"] - stats["opened"]
+        return stats
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+                self._stats["closed"] += 1
+            self._connections = {}
+        self._local = threading.local()
+
+    @staticmethod
+    def _route_from_row(route: tuple):
+        return NginxRouteCreated(**dict(zip(ROUTE_FIELDS, route)))
+
+    @staticmethod
+    def _route_values(route: NginxRoute):
+        return tuple(route.proxy_type.value if field == "proxy_type" else getattr(route, field) for field in ROUTE_FIELDS[1:])
+
+    def _get_route_cache(self, rebuild: bool = True):
+        # Reads inside a transaction must see its uncommitted writes, they always go to the database.
+        # Without rebuild a stale cache is not rebuilt, the caller reads the rows it needs from the database instead
+        if getattr(self._local, "depth", 0):
+            return None
+        cache = self._route_cache
+        if cache is not None and cache["generation"] == self.generation:
+            return cache
+        if not rebuild:
+            return None
+        # Only one thread rebuilds the table, the others wait for it and use the same cache
+        with self._cache_lock:
+            generation = self.generation
+            cache = self._route_cache
+            if cache is None or cache["generation"] != generation:
+                grouped = self._query_routes_grouped()
+                routes = sorted((route for group in grouped.values() for route in group["routes"]), key=lambda route: route.id)
+                cache = {
+                    "generation": generation,
+                    "grouped": grouped,
+                    "routes": routes,
+                    "by_id": {route.id: route for route in routes},
+                }
+                self._route_cache = cache
+        return cache
+
+    @staticmethod
+    def _copy_routes(routes: list[NginxRouteCreated]):
+        # Callers modify the returned routes, the cached ones must stay as they are in the database
+        return [route.model_copy() for route in routes]
 
     def init_db(self):
         with self.get_connection() as conn:
@@ -37,6 +210,15 @@ class Database:
                     UNIQUE(domain, path)
                 )
             ''')
+            cursor.execute('''
+                PRAGMA table_info(routes)
+            ''')
+            columns = {column[1] for column in cursor.fetchall()}
+            for column, column_type in ROUTE_MIGRATIONS.items():
+                if column not in columns:
+                    cursor.execute(f'''
+                        ALTER TABLE routes ADD COLUMN {column} {column_type}
+                    ''')
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS domains (
                     domain TEXT PRIMARY KEY NOT NULL,
@@ -44,7 +226,41 @@ class Database:
                     UNIQUE(domain)
                 )
             ''')
-            conn.commit()
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_routes_domain ON routes (domain)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_routes_enabled ON routes (enabled)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_routes_path ON routes (path)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_routes_project_name ON routes (project_name)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_routes_contact_user ON routes (contact_user)
+            ''')
+            self._commit(conn)
+        self.full_text_search = self._init_full_text_search()
+
+    def _init_full_text_search(self):
+        # SQLite builds without FTS5 fall back to LIKE in search_routes
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 1 FROM sqlite_master WHERE name = 'routes_fts'
+            ''')
+            if cursor.fetchone():
+                return True
+            try:
+                for query in FTS_TABLE_QUERIES:
+                    cursor.execute(query)
+            except sqlite3.OperationalError:
+                conn.rollback()
+                return False
+            self._commit(conn)
+            return True
 
     def add_domain_custom_config(self, domain: str, custom_config: str):
         with self.get_connection() as conn:
@@ -52,7 +268,7 @@ class Database:
             cursor.execute('''
                 INSERT INTO domains (domain, custom_config) VALUES (?, ?)
             ''', (domain, custom_config))
-            conn.commit()
+            self._commit(conn)
 
     def update_domain_custom_config(self, domain: str, custom_config: str):
         with self.get_connection() as conn:
@@ -60,7 +276,15 @@ class Database:
             cursor.execute('''
                 UPDATE domains SET custom_config = ? WHERE domain = ?
             ''', (custom_config, domain))
-            conn.commit()
+            self._commit(conn)
+
+    def add_missing_domain_custom_configs(self, custom_configs: dict[str, str]):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT OR IGNORE INTO domains (domain, custom_config) VALUES (?, ?)
+            ''', list(custom_configs.items()))
+            self._commit(conn)
 
     def get_domain_custom_config(self, domain: str):
         with self.get_connection() as conn:
@@ -71,69 +295,148 @@ class Database:
             custom_config = cursor.fetchone()
             return custom_config[0] if custom_config else None
 
-    def add_route(self, route: NginxRoute):
+    def get_domain_custom_configs(self):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                INSERT INTO routes 
-                (domain, path, proxy_type, container_id, port, target_path, static_path, enabled, info, description, custom_config, project_name, contact_user)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                route.domain,
-                route.path,
-                route.proxy_type.value,
-                route.container_id,
-                route.port,
-                route.target_path,
-                route.static_path,
-                route.enabled,
-                route.info,
-                route.description,
-                route.custom_config,
-                route.project_name,
-                route.contact_user
-            ))
-            conn.commit()
+                SELECT domain, custom_config FROM domains
+            ''')
+            return dict(cursor.fetchall())
+
+    def add_route(self, route: NginxRoute):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(INSERT_ROUTE_QUERY, self._route_values(route))
+            self._commit(conn)
             return True
 
+    def add_routes(self, routes: list[NginxRoute]):
+        # Inserts all the routes in one transaction, returns (id, None) or (None, error) for each route
+        results = []
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            for route in routes:
+                try:
+                    cursor.execute(INSERT_ROUTE_QUERY, self._route_values(route))
+                    results.append((cursor.lastrowid, None))
+                except sqlite3.IntegrityError as e:
+                    # Only the failed statement is undone, the rest of the transaction goes on
+                    results.append((None, str(e)))
+        return results
+
     def update_route(self, id: int, route: NginxRoute):
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE routes SET domain = ?, path = ?, proxy_type = ?, container_id = ?, port = ?, target_path = ?, static_path = ?, enabled = ?, info = ?, description = ?, custom_config = ?, project_name = ?, contact_user = ? WHERE id = ?
-            ''', (route.domain, route.path, route.proxy_type.value, route.container_id, route.port, route.target_path, route.static_path, route.enabled, route.info, route.description, route.custom_config, route.project_name, route.contact_user, id))
-            conn.commit()
+            cursor.execute(UPDATE_ROUTE_QUERY, (*self._route_values(route), id))
+            self._commit(conn)
             return True
 
     def get_routes_by_domain(self, domain: str):
+        cache = self._get_route_cache()
+        if cache is not None:
+            group = cache["grouped"].get(domain)
+            return self._copy_routes(group["routes"]) if group else []
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, domain, path, proxy_type, container_id, port, target_path, static_path, enabled, info, description, custom_config, project_name, contact_user
+            cursor.execute(f'''
+                SELECT {ROUTE_COLUMNS}
                     FROM routes WHERE domain = ?
             ''', (domain,))
             routes = cursor.fetchall()
-            print(routes)
-            return [
-                NginxRouteCreated(
-                    id=route[0],
-                    domain=route[1],
-                    path=route[2],
-                    proxy_type=route[3],
-                    container_id=route[4],
-                    port=route[5],
-                    target_path=route[6],   
-                    static_path=route[7],
-                    enabled=route[8],
-                    info=route[9],
-                    description=route[10],
-                    custom_config=route[11],
-                    project_name=route[12],
-                    contact_user=route[13]
-                )
-                for route in routes
-            ] 
+            return [self._route_from_row(route) for route in routes]
+
+    def get_routes_grouped_by_domain(self, domains: list[str] | None = None):
+        # Returns {domain: {"custom_config": ..., "routes": [...]}}, optionally limited to some domains
+        cache = self._get_route_cache()
+        if cache is None:
+            return self._query_routes_grouped(domains)
+        domains = set(domains) if domains is not None else None
+        return {
+            domain: {"custom_config": group["custom_config"], "routes": self._copy_routes(group["routes"])}
+            for domain, group in cache["grouped"].items()
+            if domains is None or domain in domains
+        }
+
+    def _query_routes_grouped(self, domains: list[str] | None = None):
+        query = f'''
+                SELECT d.custom_config, {", ".join("r." + field for field in ROUTE_FIELDS)}
+                    FROM routes r LEFT JOIN domains d ON d.domain = r.domain
+        '''
+        params = ()
+        if domains is not None:
+            if not domains:
+                return {}
+            query += f"WHERE r.domain IN ({', '.join('?' * len(domains))})"
+            params = tuple(domains)
+        query += " ORDER BY r.domain, r.id"
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            grouped = {}
+            for row in cursor:
+                route = self._route_from_row(row[1:])
+                if route.domain not in grouped:
+                    grouped[route.domain] = {"custom_config": row[0], "routes": []}
+                grouped[route.domain]["routes"].append(route)
+            return grouped
+
+    def get_routes_page(self, after_id: int = 0, limit: int = 1000):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {ROUTE_COLUMNS} FROM routes WHERE id > ? ORDER BY id LIMIT ?
+            ''', (after_id, limit))
+            return [self._route_from_row(route) for route in cursor.fetchall()]
+
+    @staticmethod
+    def _like_pattern(text: str):
+        # Matches text anywhere, the LIKE wildcards in it are escaped
+        return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+    def search_routes(self, after_id: int = 0, limit: int = 100, domain: str | None = None, domain_prefix: str | None = None,
+                      domain_contains: str | None = None, path_prefix: str | None = None, project_name: str | None = None,
+                      contact_user: str | None = None, enabled: bool | None = None, proxy_type: ProxyType | None = None,
+                      text: str | None = None):
+        # Keyset page of the routes matching every given filter, returns the routes and the id to continue after
+        conditions = ["id > ?"]
+        params = [after_id]
+        for column, value in (("domain", domain), ("project_name", project_name), ("contact_user", contact_user), ("enabled", enabled)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if proxy_type is not None:
+            conditions.append("proxy_type = ?")
+            params.append(proxy_type.value)
+        for column, prefix in (("domain", domain_prefix), ("path", path_prefix)):
+            if prefix:
+                conditions.append(f"{column} >= ? AND {column} < ?")
+                params.extend((prefix, prefix + PREFIX_END))
+        if domain_contains:
+            # Case insensitive substring match, LIKE ignores the case of ASCII letters
+            conditions.append("domain LIKE ? ESCAPE '\\'")
+            params.append(self._like_pattern(domain_contains))
+        words = text.split() if text else []
+        if words and self.full_text_search:
+            conditions.append("id IN (SELECT rowid FROM routes_fts WHERE routes_fts MATCH ?)")
+            # Every word is quoted so user input can not use the FTS5 query syntax, and matched as a prefix
+            params.append(" ".join('"' + word.replace('"', '""') + '"*' for word in words))
+        for word in words if not self.full_text_search else []:
+            conditions.append("(description LIKE ? ESCAPE '\\' OR info LIKE ? ESCAPE '\\')")
+            pattern = self._like_pattern(word)
+            params.extend((pattern, pattern))
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {ROUTE_COLUMNS} FROM routes WHERE {" AND ".join(conditions)} ORDER BY id LIMIT ?
+            ''', (*params, limit + 1))
+            routes = [self._route_from_row(route) for route in cursor.fetchall()]
+        next_after_id = routes[limit - 1].id if len(routes) > limit else None
+        return routes[:limit], next_after_id
+
     def get_domains(self):
+        cache = self._get_route_cache()
+        if cache is not None:
+            return list(cache["grouped"])
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
@@ -143,32 +446,17 @@ class Database:
             return [domain[0] for domain in domains]
 
     def get_all_routes(self):
+        cache = self._get_route_cache()
+        if cache is not None:
+            return self._copy_routes(cache["routes"])
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, domain, path, proxy_type, container_id, port, target_path, static_path, enabled, info, description, custom_config, project_name, contact_user
+            cursor.execute(f'''
+                SELECT {ROUTE_COLUMNS}
                 FROM routes
             ''')
             routes = cursor.fetchall()
-            return [
-                NginxRouteCreated(
-                    id=route[0],
-                    domain=route[1],
-                    path=route[2],
-                    proxy_type=route[3],
-                    container_id=route[4],
-                    port=route[5],
-                    target_path=route[6],
-                    static_path=route[7],
-                    enabled=route[8],
-                    info=route[9],
-                    description=route[10],
-                    custom_config=route[11],
-                    project_name=route[12],
-                    contact_user=route[13]
-                )
-                for route in routes
-            ] 
+            return [self._route_from_row(route) for route in routes]
         
     def deactivate_route(self, route: NginxRoute):
         with self.get_connection() as conn:
@@ -176,7 +464,16 @@ class Database:
             cursor.execute('''
                 UPDATE routes SET enabled = FALSE, info = ? WHERE id = ?
             ''', (route.info, route.id))
-            conn.commit()
+            self._commit(conn)
+
+    def deactivate_routes(self, routes: list[NginxRoute]):
+        if not routes:
+            return
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                UPDATE routes SET enabled = FALSE, info = ? WHERE id = ?
+            ''', [(route.info, route.id) for route in routes])
 
     def activate_route(self, route: NginxRoute):
         with self.get_connection() as conn:
@@ -184,31 +481,30 @@ class Database:
             cursor.execute('''
                 UPDATE routes SET enabled = TRUE, info = ? WHERE id = ?
             ''', (route.info, route.id))
-            conn.commit()   
+            self._commit(conn)   
+
+    def activate_routes(self, routes: list[NginxRoute]):
+        if not routes:
+            return
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                UPDATE routes SET enabled = TRUE, info = ? WHERE id = ?
+            ''', [(route.info, route.id) for route in routes])
 
     def get_route(self, id: int):
+        # A single route is one indexed lookup, a stale cache is not worth rebuilding for it
+        cache = self._get_route_cache(rebuild=False)
+        if cache is not None:
+            route = cache["by_id"].get(id)
+            return route.model_copy() if route else None
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, domain, path, proxy_type, container_id, port, target_path, static_path, enabled, info, description, custom_config, project_name, contact_user FROM routes WHERE id = ?
+            cursor.execute(f'''
+                SELECT {ROUTE_COLUMNS} FROM routes WHERE id = ?
             ''', (id,))
             route = cursor.fetchone()
-            return NginxRouteCreated(
-                id=route[0],
-                domain=route[1],
-                path=route[2],
-                proxy_type=route[3],
-                container_id=route[4],
-                port=route[5],
-                target_path=route[6],
-                static_path=route[7],
-                enabled=route[8],
-                info=route[9],
-                description=route[10],
-                custom_config=route[11],
-                project_name=route[12],
-                contact_user=route[13]
-            ) if route else None
+            return self._route_from_row(route) if route else None
         
     def delete_route(self, id: int):
         with self.get_connection() as conn:
@@ -216,7 +512,7 @@ class Database:
             cursor.execute('''
                 DELETE FROM routes WHERE id = ?
             ''', (id,))
-            conn.commit()   
+            self._commit(conn)   
 
     def delete_domain_custom_config(self, domain: str):
         with self.get_connection() as conn:
@@ -224,4 +520,4 @@ class Database:
             cursor.execute('''
                 DELETE FROM domains WHERE domain = ?
             ''', (domain,))
-            conn.commit()
\ No newline at end of file
+            self._commit(conn)
\ No newline at end of file
@@ -0,0 +1,151 @@
+import threading
+from typing import Callable
+from database import Database
+from docker_utils import DockerUtils, is_id_prefix, AUTO_DISABLED_INFO, CONTAINER_NOT_FOUND, CONTAINER_NOT_CONNECTED, CONTAINER_NOT_RUNNING
+from nginx_utils import DirtyDomainTracker
+from schema import NginxRoute, ProxyType
+from metrics import ROUTES_DEACTIVATED
+
+EVENT_FILTERS = {
+    "type": ["container", "network"],
+    "event": ["start", "die", "destroy", "connect", "disconnect"],
+}
+
+class DockerEventWatcher:
+    def __init__(self, docker_utils: DockerUtils, db: Database, dirty_domains: DirtyDomainTracker,
+                 on_change: Callable[[], None] | None = None, push_delay: float = 5.0):
+        self.docker_utils = docker_utils
+        self.db = db
+        self.dirty_domains = dirty_domains
+        self.on_change = on_change
+        self.push_delay = push_delay
+        self.watching = False
+        self._stopped = threading.Event()
+        self._thread = None
+        self._stream = None
+        self._lock = threading.Lock()
+        self._push_timer = None
+        # container id -> container names, needed to resolve network events
+        self._names = {}
+        # route container_id -> routes, rebuilt when the database generation changes
+        self._routes = {}
+        self._routes_generation = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="docker-events", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._stream:
+            self._stream.close()
+        with self._lock:
+            if self._push_timer:
+                self._push_timer.cancel()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                # Subscribe before the sync so no event between both is lost
+                self._stream = self.docker_utils.docker_client.events(decode=True, filters=EVENT_FILTERS)
+                self.sync()
+                self.watching = True
+                for event in self._stream:
+                    self.handle_event(event)
+            except Exception as e:
+                if not self._stopped.is_set():
+                    print(f"Docker events stream error: {e}")
+            self.watching = False
+            self._stopped.wait(5)
+
+    def _get_routes_index(self):
+        generation = self.db.generation
+        if self._routes_generation != generation:
+            routes = {}
+            for route in self.db.get_all_routes():
+                if route.proxy_type == ProxyType.docker and route.container_id:
+                    routes.setdefault(route.container_id, []).append(route)
+            self._routes = routes
+            self._routes_generation = generation
+        return self._routes
+
+    def _find_routes(self, container_id: str, names: list[str]):
+        keys = set(names) | {container_id}
+        known_names = {name for container_names in self._names.values() for name in container_names}
+        routes = []
+        for key, key_routes in self._get_routes_index().items():
+            if key in keys or is_id_prefix(key, container_id, known_names):
+                routes.extend(key_routes)
+        return routes
+
+    def sync(self):
+        index = self.docker_utils.get_containers_snapshot()
+        self._names = {record["id"]: record["names"] for record in index.values()}
+        by_error = {}
+        for key, routes in self._get_routes_index().items():
+            error = self.docker_utils.get_route_error(self.docker_utils.find_container(index, key))
+            by_error.setdefault(error, []).extend(routes)
+        for error, routes in by_error.items():
+            self.apply(routes, error)
+
+    def handle_event(self, event: dict):
+        action = event.get("Action") or event.get("status")
+        actor = event.get("Actor") or {}
+        attributes = actor.get("Attributes") or {}
+        if event.get("Type") == "network":
+            if attributes.get("name") != self.docker_utils.docker_network.name:
+                return
+            container_id = attributes.get("container")
+            error = CONTAINER_NOT_CONNECTED if action == "disconnect" else None
+        else:
+            container_id = actor.get("ID")
+            if "name" in attributes:
+                self._names[container_id] = [attributes["name"]]
+            error = {"die": CONTAINER_NOT_RUNNING, "destroy": CONTAINER_NOT_FOUND}.get(action)
+        names = self._names.get(container_id, [])
+        if action == "destroy":
+            self._names.pop(container_id, None)
+        routes = self._find_routes(container_id, names)
+        if not routes:
+            return
+        if error is None:
+            # A start or a connect only fixes the routes if the container is also running and on the network
+            error = self.docker_utils.get_route_error(self.docker_utils.inspect_container(container_id))
+        self.apply(routes, error)
+
+    def apply(self, routes: list[NginxRoute], error: str | None):
+        if error:
+            changed = [route for route in routes if route.enabled or (route.info in AUTO_DISABLED_INFO and route.info != error)]
+            ROUTES_DEACTIVATED.inc(sum(1 for route in changed if route.enabled))
+            for route in changed:
+                route.enabled = False
+                route.info = error
+            self.db.deactivate_routes(changed)
+        else:
+            changed = [route for route in routes if not route.enabled and route.info in AUTO_DISABLED_INFO]
+            for route in changed:
+                route.enabled = True
+                route.info = "OK"
+            self.db.activate_routes(changed)
+        if changed:
+            print(f"Docker events: {len(changed)} routes {'deactivated' if error else 'activated'}")
+            self.dirty_domains.mark(*[route.domain for route in changed])
+            self._schedule_push()
+
+    def _schedule_push(self):
+        if not self.on_change:
+            return
+        with self._lock:
+            if self._push_timer:
+                self._push_timer.cancel()
+            self._push_timer = threading.Timer(self.push_delay, self._push)
+            self._push_timer.daemon = True
+            self._push_timer.start()
+
+    def _push(self):
+        try:
+            self.on_change()
+        except Exception as e:
+            print(f"Error pushing nginx config after docker events: {e}")
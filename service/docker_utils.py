@@ -1,9 +1,64 @@
+import asyncio
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 import docker
-from schema import Config, NginxRoute, ProxyType
+from starlette.concurrency import run_in_threadpool
+from schema import Config, NginxRoute, ProxyType, ReloadMode
 from database import Database
+from async_docker import AsyncDockerClient
+from metrics import DOCKER_ENGINE_SECONDS, ROUTES_DEACTIVATED, timed
+
+CONTAINER_NOT_FOUND = "Docker container not found"
+CONTAINER_NOT_CONNECTED = "Docker container not connected to the network"
+CONTAINER_NOT_RUNNING = "Docker container not running"
+# Only routes disabled by the container checks are touched again, never the manually deactivated ones
+AUTO_DISABLED_INFO = {CONTAINER_NOT_FOUND, CONTAINER_NOT_CONNECTED, CONTAINER_NOT_RUNNING}
+# Shortest abbreviated container id accepted as a prefix, the length docker prints
+ID_PREFIX_RE = re.compile(r"^[0-9a-f]{12,}$")
+
+def is_id_prefix(key: str, container_id: str | None, names) -> bool:
+    # Docker also accepts unique id prefixes. Only hex keys long enough to be an abbreviated id can match,
+    # and a key naming a container is never taken as the prefix of another one
+    return bool(container_id) and bool(ID_PREFIX_RE.match(key)) and container_id.startswith(key) and key not in names
+
+def nginx_reload_steps(mode: ReloadMode, name: str = "Nginx"):
+    # Applies a new config to an nginx container, shared by the local container and the nginx nodes. The generator
+    # yields the engine calls to make, ("status",), ("exec", cmd) or ("restart",), receives their results and the
+    # engine errors are thrown into it. It returns the result of the reload
+    start = time.perf_counter()
+    result = {"mode": mode.value, "valid": None, "output": "", "reloaded": False}
+    if mode == ReloadMode.reload:
+        try:
+            status = yield ("status",)
+            if status == "running":
+                exit_code, output = yield ("exec", ["nginx", "-t"])
+                result["valid"] = exit_code == 0
+                result["output"] = output.decode(errors="replace")
+                if not result["valid"]:
+                    # Restarting with a config that fails the test would take nginx down,
+                    # the running workers keep serving the previous config instead
+                    result["latency_ms"] = (time.perf_counter() - start) * 1000
+                    return result
+                exit_code, output = yield ("exec", ["nginx", "-s", "reload"])
+                result["output"] += output.decode(errors="replace")
+                if exit_code == 0:
+                    result["reloaded"] = True
+                    result["latency_ms"] = (time.perf_counter() - start) * 1000
+                    return result
+            else:
+                result["output"] = f"Nginx container is {status}, it can not be reloaded"
+        except docker.errors.APIError as e:
+            result["output"] += str(e)
+        print(f"{name} reload not possible, restarting the container: {result['output']}")
+    yield ("restart",)
+    result["mode"] = ReloadMode.restart.value
+    result["reloaded"] = True
+    result["latency_ms"] = (time.perf_counter() - start) * 1000
+    return result
 
 class DockerUtils:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, db: Database):
         self.config = config
         try:
             # Intentar primero usar from_env()
@@ -17,7 +72,8 @@ class DockerUtils:
                 raise
 
         self.docker_network = self._get_docker_network()
-        self.db = Database()
+        self.async_client = AsyncDockerClient.from_config(config.docker)
+        self.db = db
 
     def _get_docker_network(self):
         try:
@@ -32,27 +88,198 @@ class DockerUtils:
     def get_docker_client(self):
         return self.docker_client.containers.list()
 
+    async def get_docker_client_async(self):
+        return await self.async_client.list_containers(all=False)
+
+    def _container_record(self, attrs: dict, connected_ids: set[str]):
+        # Same shape for the sparse container list and the full container inspect
+        networks = (attrs.get("NetworkSettings") or {}).get("Networks") or {}
+        names = attrs.get("Names") or [attrs.get("Name") or ""]
+        state = attrs.get("State")
+        labels = attrs.get("Labels") or (attrs.get("Config") or {}).get("Labels") or {}
+        service = (labels.get("com.docker.compose.project"), labels.get("com.docker.compose.service"))
+        return {
+            "id": attrs["Id"],
+            "names": [name.lstrip("/") for name in names if name],
+            "status": state.get("Status") if isinstance(state, dict) else state,
+            "connected": attrs["Id"] in connected_ids or self.docker_network.name in networks,
+            "service": service if service[1] else None,
+        }
+
+    def index_containers(self, containers: list[dict], network: dict):
+        connected_ids = set(network.get("Containers") or {})
+        index = {}
+        for attrs in containers:
+            record = self._container_record(attrs, connected_ids)
+            index[record["id"]] = record
+            for name in record["names"]:
+                index[name] = record
+        return index
+
+    @timed(DOCKER_ENGINE_SECONDS, call="get_containers_snapshot")
+    def get_containers_snapshot(self):
+        # One engine call for every container plus one network inspect, instead of one call per route
+        containers = self.docker_client.api.containers(all=True)
+        network = self.docker_client.api.inspect_network(self.docker_network.id)
+        return self.index_containers(containers, network)
+
+    @staticmethod
+    def find_container(index: dict, container_id: str | None):
+        if not container_id:
+            return None
+        if container_id in index:
+            return index[container_id]
+        matches = {record["id"] for key, record in index.items() if key == record["id"] and is_id_prefix(container_id, key, index)}
+        return index[matches.pop()] if len(matches) == 1 else None
+
+    def get_service_replicas(self, container_ids: set[str]):
+        # Maps each container of a compose service to the names of every running replica of that service on the network
+        try:
+            index = self.get_containers_snapshot()
+        except docker.errors.APIError as e:
+            print(f"Error listing docker containers: {e}")
+            return {}
+        services = {}
+        for key, record in index.items():
+            if key == record["id"] and record["service"] and record["names"] and not self.get_route_error(record):
+                services.setdefault(record["service"], []).append(record["names"][0])
+        replicas = {}
+        for container_id in container_ids:
+            record = self.find_container(index, container_id)
+            if record and record["service"] in services:
+                replicas[container_id] = sorted(services[record["service"]])
+        return replicas
+
+    @timed(DOCKER_ENGINE_SECONDS, call="inspect_container")
+    def inspect_container(self, container_id: str):
+        try:
+            return self._container_record(self.docker_client.api.inspect_container(container_id), set())
+        except docker.errors.NotFound:
+            return None
+
+    @staticmethod
+    def get_route_error(container: dict | None):
+        if container is None:
+            return CONTAINER_NOT_FOUND
+        if not container["connected"]:
+            return CONTAINER_NOT_CONNECTED
+        if container["status"] != "running":
+            return CONTAINER_NOT_RUNNING
+        return None
+
+    def resolve_containers(self, container_ids: set[str]):
+        try:
+            index = self.get_containers_snapshot()
+        except docker.errors.APIError as e:
+            print(f"Error listing docker containers: {e}")
+            index = {}
+        resolved = {container_id: self.find_container(index, container_id) for container_id in container_ids}
+        # Containers missing from the snapshot (or every container if the list failed) are looked up one by one
+        missing = [container_id for container_id, record in resolved.items() if record is None and container_id]
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(self.config.docker.max_workers, len(missing))) as pool:
+                resolved.update(zip(missing, pool.map(self.inspect_container, missing)))
+        return resolved
+
+    async def inspect_container_async(self, container_id: str):
+        try:
+            return self._container_record(await self.async_client.inspect_container(container_id), set())
+        except docker.errors.NotFound:
+            return None
+
+    async def resolve_containers_async(self, container_ids: set[str]):
+        try:
+            containers, network = await asyncio.gather(
+                self.async_client.list_containers(all=True),
+                self.async_client.inspect_network(self.docker_network.id))
+            index = self.index_containers(containers, network)
+        except docker.errors.DockerException as e:
+            print(f"Error listing docker containers: {e}")
+            index = {}
+        resolved = {container_id: self.find_container(index, container_id) for container_id in container_ids}
+        missing = [container_id for container_id, record in resolved.items() if record is None and container_id]
+        if missing:
+            resolved.update(zip(missing, await asyncio.gather(*[self.inspect_container_async(container_id) for container_id in missing])))
+        return resolved
+
+    @staticmethod
+    def _get_verified_routes(routes: list[NginxRoute]):
+        return [route for route in routes if route.proxy_type == ProxyType.docker and (route.enabled or route.info in AUTO_DISABLED_INFO)]
+
     def verify_dockers(self, routes: list[NginxRoute]):
-        for route in routes:
-            if route.proxy_type == ProxyType.docker:
-                try:
-                    registered = self.docker_client.containers.get(route.container_id)
-                    if self.docker_network.name not in registered.attrs["NetworkSettings"]["Networks"]:
-                        route.info = "Docker container not connected to the network"
-                        self.db.deactivate_route(route)
-                except docker.errors.NotFound:
-                    route.info = "Docker container not found"
-                    self.db.deactivate_route(route)
+        # Returns the routes that were enabled and have been deactivated
+        docker_routes = self._get_verified_routes(routes)
+        if not docker_routes:
+            return []
+        containers = self.resolve_containers({route.container_id for route in docker_routes})
+        failed, deactivated = self._apply_containers(docker_routes, containers)
+        self.db.deactivate_routes(failed)
+        ROUTES_DEACTIVATED.inc(len(deactivated))
+        return deactivated
+
+    async def verify_dockers_async(self, routes: list[NginxRoute]):
+        docker_routes = self._get_verified_routes(routes)
+        if not docker_routes:
+            return []
+        containers = await self.resolve_containers_async({route.container_id for route in docker_routes})
+        failed, deactivated = self._apply_containers(docker_routes, containers)
+        await run_in_threadpool(self.db.deactivate_routes, failed)
+        ROUTES_DEACTIVATED.inc(len(deactivated))
+        return deactivated
+
+    def _apply_containers(self, docker_routes: list[NginxRoute], containers: dict):
+        failed = []
+        deactivated = []
+        for route in docker_routes:
+            error = self.get_route_error(containers[route.container_id])
+            if error:
+                if route.enabled:
+                    deactivated.append(route)
+                route.info = error
+                route.enabled = False
+                failed.append(route)
+        return failed, deactivated
 
     def get_docker_network(self):
         return self.docker_network
     
+    @timed(DOCKER_ENGINE_SECONDS, call="connect_containers")
     def connect_containers(self, routes: list[NginxRoute]):
         for route in routes:
             self.docker_network.connect(route.container_id)
 
+    async def connect_containers_async(self, routes: list[NginxRoute]):
+        await asyncio.gather(*[self.async_client.connect_network(self.docker_network.id, route.container_id) for route in routes])
+
+    @timed(DOCKER_ENGINE_SECONDS, call="restart_container")
     def restart_container(self, container_id: str):
         self.docker_client.containers.get(container_id).restart()
 
+    @timed(DOCKER_ENGINE_SECONDS, call="reload_nginx")
+    def reload_nginx(self, container_id: str, mode: ReloadMode = ReloadMode.reload):
+        container = None
+        steps = nginx_reload_steps(mode)
+        value, error = None, None
+        while True:
+            try:
+                step = steps.throw(error) if error else steps.send(value)
+            except StopIteration as stop:
+                return stop.value
+            value, error = None, None
+            try:
+                if step[0] == "status":
+                    container = self.docker_client.containers.get(container_id)
+                    value = container.status
+                elif step[0] == "exec":
+                    value = container.exec_run(step[1])
+                else:
+                    self.restart_container(container_id)
+            except docker.errors.APIError as e:
+                error = e
+
+    @timed(DOCKER_ENGINE_SECONDS, call="get_container_info")
     def get_container_info(self, container_id: str):
-        return self.docker_client.containers.get(container_id).attrs
\ No newline at end of file
+        return self.docker_client.containers.get(container_id).attrs
+
+    async def get_container_info_async(self, container_id: str):
+        return await self.async_client.inspect_container(container_id)
\ No newline at end of file
@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Callable
+import httpx
+from database import Database
+from nginx_utils import DirtyDomainTracker
+from schema import HealthConfig, NginxRoute, ProxyType
+from metrics import HEALTH_PROBES, ROUTES_DEACTIVATED
+
+HEALTH_CHECK_FAILED = "Health check failed"
+
+class RouteHealth:
+    def __init__(self, samples: int):
+        self.latencies = deque(maxlen=samples)
+        self.results = deque(maxlen=samples)
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        self.last_status = None
+        self.last_error = None
+        self.last_probe_at = None
+
+    def record(self, up: bool, latency: float, status: int | None, error: str | None):
+        self.results.append(up)
+        if up:
+            self.latencies.append(latency)
+            self.consecutive_failures = 0
+            self.consecutive_successes += 1
+        else:
+            self.consecutive_failures += 1
+            self.consecutive_successes = 0
+        self.last_status = status
+        self.last_error = error
+        self.last_probe_at = time.time()
+
+    @staticmethod
+    def _percentile(values: list[float], percentile: float):
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(len(values) * percentile))] * 1000
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return {
+            "up": self.results[-1] if self.results else None,
+            "availability": sum(self.results) / len(self.results) if self.results else None,
+            "samples": len(self.results),
+            "p50_ms": self._percentile(latencies, 0.5),
+            "p90_ms": self._percentile(latencies, 0.9),
+            "p99_ms": self._percentile(latencies, 0.99),
+            "consecutive_failures": self.consecutive_failures,
+            "last_status": self.last_status,
+            "last_error": self.last_error,
+            "last_probe_at": self.last_probe_at,
+        }
+
+class HealthProber:
+    # Sends a request to every enabled docker route each interval, keeping the latencies and results of the last
+    # probes. Routes failing failure_threshold probes in a row are disabled, and enabled again after as many successes.
+    def __init__(self, config: HealthConfig, db: Database, dirty_domains: DirtyDomainTracker,
+                 on_change: Callable[[], None] | None = None):
+        self.config = config
+        self.db = db
+        self.dirty_domains = dirty_domains
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._health = {}
+        self._routes = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="health-prober", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=self.config.timeout + 5)
+
+    def _run(self):
+        asyncio.run(self._loop())
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        limits = httpx.Limits(max_connections=self.config.max_concurrency, max_keepalive_connections=self.config.max_concurrency)
+        async with httpx.AsyncClient(timeout=self.config.timeout, limits=limits, follow_redirects=False) as client:
+            while not self._stopped.is_set():
+                try:
+                    await self.probe_all(client)
+                except Exception as e:
+                    print(f"Error probing the routes: {e}")
+                await loop.run_in_executor(None, self._stopped.wait, self.config.interval)
+
+    @staticmethod
+    def get_url(route: NginxRoute):
+        target_path = route.target_path or "/"
+        return f"http://{route.container_id}:{route.port}{target_path if target_path[0] == '/' else '/' + target_path}"
+
+    def _get_routes(self):
+        # Routes disabled by the prober are still probed so they can be enabled again
+        return [
+            route for route in self.db.get_all_routes()
+            if route.proxy_type == ProxyType.docker and route.container_id and route.port
+            and (route.enabled or route.info == HEALTH_CHECK_FAILED)
+        ]
+
+    async def probe_all(self, client: httpx.AsyncClient):
+        routes = self._get_routes()
+        semaphore = asyncio.Semaphore(self.config.max_concurrency)
+
+        async def probe(route: NginxRoute):
+            async with semaphore:
+                return await self.probe(client, route)
+
+        results = await asyncio.gather(*[probe(route) for route in routes])
+        with self._lock:
+            self._routes = {route.id: route for route in routes}
+            # Routes deleted or disabled by hand are forgotten
+            for route_id in set(self._health) - set(self._routes):
+                del self._health[route_id]
+            for route, result in zip(routes, results):
+                self._health.setdefault(route.id, RouteHealth(self.config.samples)).record(*result)
+        self._apply(routes)
+
+    async def probe(self, client: httpx.AsyncClient, route: NginxRoute):
+        start = time.perf_counter()
+        try:
+            response = await client.get(self.get_url(route))
+            up, status = response.status_code < 500, response.status_code
+            error = None if up else f"HTTP {status}"
+        except httpx.HTTPError as e:
+            up, status, error = False, None, str(e) or type(e).__name__
+        HEALTH_PROBES.inc(result="up" if up else "down")
+        return up, time.perf_counter() - start, status, error
+
+    def _apply(self, routes: list[NginxRoute]):
+        threshold = self.config.failure_threshold
+        if not threshold:
+            return
+        with self._lock:
+            failed = [route for route in routes if route.enabled and self._health[route.id].consecutive_failures >= threshold]
+            recovered = [route for route in routes if not route.enabled and self._health[route.id].consecutive_successes >= threshold]
+        for route in failed:
+            route.enabled = False
+            route.info = HEALTH_CHECK_FAILED
+        for route in recovered:
+            route.enabled = True
+            route.info = "OK"
+        self.db.deactivate_routes(failed)
+        self.db.activate_routes(recovered)
+        ROUTES_DEACTIVATED.inc(len(failed))
+        if failed or recovered:
+            print(f"Health checks: {len(failed)} routes deactivated, {len(recovered)} activated")
+            self.dirty_domains.mark(*[route.domain for route in failed + recovered])
+            if self.on_change:
+                self.on_change()
+
+    def get_health(self, route_id: int | None = None):
+        with self._lock:
+            return [
+                {"id": id, "domain": route.domain, "path": route.path, "url": self.get_url(route), **self._health[id].summary()}
+                for id, route in self._routes.items()
+                if id in self._health and (route_id is None or id == route_id)
+            ]
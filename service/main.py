@@ -1,19 +1,58 @@
-from fastapi import FastAPI, HTTPException
-from schema import NginxRoute, Config
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
+from schema import NginxRoute, Config, ProxyType, UpstreamMode
 from database import Database
 from contextlib import asynccontextmanager
 from docker_utils import DockerUtils
+from docker_events import DockerEventWatcher
+from health_prober import HealthProber
+from nginx_fleet import NginxFleet
 from nginx_utils import NginxUtils
+from push_scheduler import PushScheduler
+import metrics
+import nginx_importer
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 
 @asynccontextmanager
 async def startup_event(fastapi_app: FastAPI):
     # Any initialization code can go here
     fastapi_app.config = Config.load_from_yaml("config.yaml")
-    fastapi_app.docker_utils = DockerUtils(fastapi_app.config)
+    fastapi_app.docker_utils = DockerUtils(fastapi_app.config, db)
     fastapi_app.nginx_utils = NginxUtils(fastapi_app.config)
+    fastapi_app.nginx_fleet = None
+    if fastapi_app.config.nginx.nodes:
+        fastapi_app.nginx_fleet = NginxFleet(fastapi_app.config.nginx.nodes, fastapi_app.config.nginx.reload_mode)
+    fastapi_app.push_scheduler = PushScheduler(push_nginx_config, delay=fastapi_app.config.nginx.push_delay)
+    fastapi_app.push_scheduler.start()
+    fastapi_app.docker_events = None
+    if fastapi_app.config.docker.watch_events:
+        fastapi_app.docker_events = DockerEventWatcher(
+            fastapi_app.docker_utils, db, fastapi_app.nginx_utils.dirty_domains,
+            on_change=fastapi_app.push_scheduler.request if fastapi_app.config.docker.events_auto_push else None,
+            push_delay=fastapi_app.config.docker.events_push_delay)
+        fastapi_app.docker_events.start()
+    fastapi_app.health_prober = None
+    if fastapi_app.config.health.enabled:
+        fastapi_app.health_prober = HealthProber(
+            fastapi_app.config.health, db, fastapi_app.nginx_utils.dirty_domains,
+            on_change=fastapi_app.push_scheduler.request if fastapi_app.config.health.auto_push else None)
+        fastapi_app.health_prober.start()
     print("FastAPI application has started.")
     yield
+    if fastapi_app.health_prober:
+        fastapi_app.health_prober.stop()
+    if fastapi_app.docker_events:
+        fastapi_app.docker_events.stop()
+    fastapi_app.push_scheduler.stop()
+    await fastapi_app.docker_utils.async_client.aclose()
+    db.close()
     print("FastAPI application has stopped.")
 
 nginx_app = FastAPI(lifespan=startup_event)
@@ -29,35 +68,68 @@ nginx_app.add_middleware(
 db = Database()
 nginx_app.config = None
 
+# Serialized listings of the current database generation, the token keeps ETags from matching after a restart.
+# Only the least recently used listings are kept, one per domain at most
+response_cache = {"generation": None, "responses": OrderedDict()}
+response_cache_lock = threading.Lock()
+response_cache_token = uuid.uuid4().hex[:8]
+RESPONSE_CACHE_SIZE = 128
+
+def cached_response(request: Request, key: str | None, build):
+    # Without a key the body is built on every request and not kept, the ETag still answers unchanged listings
+    generation = db.generation
+    etag = f'W/"{response_cache_token}-{generation}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    body = None
+    if key is not None:
+        with response_cache_lock:
+            if response_cache["generation"] != generation:
+                response_cache["generation"] = generation
+                response_cache["responses"] = OrderedDict()
+            body = response_cache["responses"].get(key)
+            if body is not None:
+                response_cache["responses"].move_to_end(key)
+    if body is None:
+        body = json.dumps(build()).encode()
+        if key is not None:
+            with response_cache_lock:
+                if response_cache["generation"] == generation:
+                    response_cache["responses"][key] = body
+                    while len(response_cache["responses"]) > RESPONSE_CACHE_SIZE:
+                        response_cache["responses"].popitem(last=False)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 
 @nginx_app.get("/config", tags=["config"])
 def get_config():
     return nginx_app.config.model_dump()
 
 @nginx_app.get("/docker_client", tags=["docker"])
-def get_docker_client():
-    print(nginx_app.docker_utils.get_docker_client())
+async def get_docker_client():
+    print(await nginx_app.docker_utils.get_docker_client_async())
     return {"message": "Docker client retrieved successfully"}
 
 @nginx_app.post("/verify_dockers", tags=["docker"])
-def verify_dockers():
-    nginx_app.docker_utils.verify_dockers(db.get_all_routes())
+async def verify_dockers():
+    deactivated = await nginx_app.docker_utils.verify_dockers_async(await run_in_threadpool(db.get_all_routes))
+    nginx_app.nginx_utils.dirty_domains.mark(*[route.domain for route in deactivated])
     return {"message": "Dockers verified successfully"}
 
 @nginx_app.post("/connect_containers", tags=["docker"])
-def connect_containers():
-    nginx_app.docker_utils.connect_containers(db.get_all_routes())
+async def connect_containers():
+    await nginx_app.docker_utils.connect_containers_async(await run_in_threadpool(db.get_all_routes))
     return {"message": "Containers connected successfully"}
 
 @nginx_app.put("/connect_container/{id}", tags=["docker"])
-def connect_container(id: int):
-    nginx_app.docker_utils.connect_containers([db.get_route(id)])
+async def connect_container(id: int):
+    await nginx_app.docker_utils.connect_containers_async([await run_in_threadpool(db.get_route, id)])
     return {"message": "Container connected successfully"}
 
 @nginx_app.get("/domains", tags=["domains"])
-def get_domains():
-    domains = db.get_domains()
-    return {"domains": domains}
+def get_domains(request: Request):
+    return cached_response(request, "domains", lambda: {"domains": db.get_domains()})
 
 @nginx_app.get("/domains/{domain}", tags=["domains"])
 def get_domain_custom_config(domain: str):
@@ -67,40 +139,149 @@ def get_domain_custom_config(domain: str):
 @nginx_app.put("/domains/{domain}", tags=["domains"])
 def add_domain_custom_config(domain: str, custom_config: dict):
     db.update_domain_custom_config(domain, custom_config["config"])
+    nginx_app.nginx_utils.dirty_domains.mark(domain)
     return {"message": "Domain custom config added successfully"}
 
+@nginx_app.get("/routes/export", tags=["routes"])
+async def export_routes(page_size: int = 1000):
+    async def lines():
+        after_id = 0
+        while True:
+            routes = await run_in_threadpool(db.get_routes_page, after_id, page_size)
+            if not routes:
+                return
+            yield "".join(route.model_dump_json() + "\n" for route in routes)
+            after_id = routes[-1].id
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def import_routes_batch(batch: list[tuple[int, NginxRoute]], known_domains: set[str]):
+    # Default configs are only rendered for the domains not seen before in this import
+    new_domains = {route.domain for _, route in batch} - known_domains
+    with db.transaction():
+        db.add_missing_domain_custom_configs({domain: nginx_app.nginx_utils.get_default_domain_config(domain) for domain in new_domains})
+        results = db.add_routes([route for _, route in batch])
+    known_domains.update(new_domains)
+    nginx_app.nginx_utils.dirty_domains.mark(*[route.domain for (_, route), (id, _) in zip(batch, results) if id])
+    return [
+        {"line": line, "id": id} if id else {"line": line, "error": error}
+        for (line, _), (id, error) in zip(batch, results)
+    ]
+
+@nginx_app.post("/routes/bulk", tags=["routes"])
+async def import_routes(request: Request, batch_size: int = 500):
+    # The NDJSON body is parsed while it arrives and inserted in batches, one result line per route
+    results = []
+    batch = []
+    known_domains = set()
+    line_number = 0
+    buffer = b""
+
+    async def flush():
+        results.extend(await run_in_threadpool(import_routes_batch, batch[:], known_domains))
+        batch.clear()
+
+    async def parse(line: bytes):
+        if not line.strip():
+            return
+        try:
+            route = NginxRoute.model_validate_json(line)
+        except ValidationError as e:
+            results.append({"line": line_number, "error": e.errors(include_url=False, include_context=False, include_input=False)})
+            return
+        if not route.domain:
+            route.domain = "default"
+        batch.append((line_number, route))
+        if len(batch) >= batch_size:
+            await flush()
+
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            await parse(line)
+    if buffer:
+        line_number += 1
+        await parse(buffer)
+    if batch:
+        await flush()
+
+    imported = sum(1 for result in results if "id" in result)
+    summary = {"summary": {"lines": line_number, "imported": imported, "failed": len(results) - imported}}
+    return StreamingResponse(
+        (json.dumps(result) + "\n" for result in [*results, summary]),
+        media_type="application/x-ndjson")
+
+@nginx_app.post("/import/nginx_config", tags=["routes"])
+def import_nginx_config(body: dict):
+    # Reads existing nginx .conf files (a directory or a glob) and shows or applies the routes found in them.
+    # The path must be inside import_path or config_path, relative paths start at the first one
+    if not body.get("path"):
+        raise HTTPException(status_code=400, detail="A path to the nginx config files is required")
+    roots = [root for root in (nginx_app.config.nginx.import_path, nginx_app.config.nginx.config_path) if root]
+    try:
+        result = nginx_importer.import_nginx_config(
+            body["path"], db, nginx_app.config.nginx.config_warn_message, dry_run=body.get("dry_run", True),
+            static_root=nginx_app.config.nginx.static_path, roots=roots)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not result["dry_run"]:
+        nginx_app.nginx_utils.dirty_domains.mark(*result["domains"])
+    return result
+
 @nginx_app.get("/routes/{domain}", tags=["routes"])
-def get_routes_filtered_by_domain(domain: str):
-    routes = db.get_routes_by_domain(domain)
-    return {"routes": [route.model_dump() for route in routes]}
+def get_routes_filtered_by_domain(domain: str, request: Request):
+    return cached_response(request, f"routes/{domain}", lambda: {
+        "routes": [route.model_dump(mode="json") for route in db.get_routes_by_domain(domain)]
+    })
 
 @nginx_app.get("/routes_by_domain", tags=["routes"])
-def get_routes_grouped_by_domain():
-    domains = db.get_domains()
-    routes = {}
-    for domain in domains:
-        routes[domain] = [route.model_dump() for route in db.get_routes_by_domain(domain)]
-    return {"routes": routes}
+def get_routes_grouped_by_domain(request: Request):
+    return cached_response(request, "routes_by_domain", lambda: {
+        "routes": {domain: [route.model_dump(mode="json") for route in group["routes"]] for domain, group in db.get_routes_grouped_by_domain().items()}
+    })
 
 @nginx_app.get("/routes", tags=["routes"])
-def get_routes():
-    routes = db.get_all_routes()
-    return {"routes": [route.model_dump() for route in routes]}
+def get_routes(request: Request, after_id: int | None = None, limit: int | None = None, domain: str | None = None,
+               domain_prefix: str | None = None, domain_contains: str | None = None, path: str | None = None,
+               project_name: str | None = None, contact_user: str | None = None, enabled: bool | None = None,
+               proxy_type: ProxyType | None = None, q: str | None = None):
+    # Without parameters every route is returned, as always. Any parameter returns one page of the matching routes,
+    # the next page starts after next_after_id. path is a prefix, domain_contains matches any part of the domain
+    # ignoring case, q searches the description and info of the routes
+    if not request.query_params:
+        return cached_response(request, "routes", lambda: {
+            "routes": [route.model_dump(mode="json") for route in db.get_all_routes()]
+        })
+    limit = min(max(limit or 100, 1), 1000)
+
+    def build():
+        routes, next_after_id = db.search_routes(
+            after_id or 0, limit, domain=domain, domain_prefix=domain_prefix, domain_contains=domain_contains, path_prefix=path,
+            project_name=project_name, contact_user=contact_user, enabled=enabled, proxy_type=proxy_type, text=q)
+        return {"routes": [route.model_dump(mode="json") for route in routes], "next_after_id": next_after_id}
+    # Every query string is a different page, they are not kept
+    return cached_response(request, None, build)
 
 @nginx_app.post("/route", tags=["routes"])
 def register_route(route: NginxRoute):
     if not route.domain or route.domain == "":
         route.domain = "default"
-    domain = db.get_domain_custom_config(route.domain)
-    if not domain:
-        db.add_domain_custom_config(route.domain, nginx_app.nginx_utils.get_default_domain_config(route.domain))
-    if db.add_route(route):
+    with db.transaction():
+        domain = db.get_domain_custom_config(route.domain)
+        if not domain:
+            db.add_domain_custom_config(route.domain, nginx_app.nginx_utils.get_default_domain_config(route.domain))
+        added = db.add_route(route)
+    if added:
+        nginx_app.nginx_utils.dirty_domains.mark(route.domain)
         return {"message": "Route registered successfully", "route": route}
     raise HTTPException(status_code=500)
 
 @nginx_app.put("/route/{id}", tags=["routes"])
 def update_route(id: int, route: NginxRoute):
+    previous = db.get_route(id)
     if db.update_route(id, route):
+        nginx_app.nginx_utils.dirty_domains.mark(route.domain, previous.domain if previous else None)
         return {"message": "Route updated successfully", "route": route}
     raise HTTPException(status_code=500)
 
@@ -111,6 +292,7 @@ def deactivate_route(id: int):
         route.enabled = False
         route.info = "Manually deactivated"
         db.deactivate_route(route)
+        nginx_app.nginx_utils.dirty_domains.mark(route.domain)
         return {"message": "Route deactivated successfully", "route": route}
     raise HTTPException(status_code=404)
 
@@ -122,32 +304,152 @@ def activate_route(id: int):
         route.info = "OK"
         db.activate_route(route)
         nginx_app.docker_utils.verify_dockers([route])
+        nginx_app.nginx_utils.dirty_domains.mark(route.domain)
         return {"route": route.model_dump()}
     raise HTTPException(status_code=404)
 
 @nginx_app.delete("/route/{id}", tags=["routes"])
 def delete_route(id: int):
     route = db.get_route(id)
-    db.delete_route(id)
-    domain = db.get_domain_custom_config(route.domain)
-    routes = db.get_routes_by_domain(route.domain)
-    if len(routes) == 0:
-        db.delete_domain_custom_config(route.domain)
+    with db.transaction():
+        db.delete_route(id)
+        domain = db.get_domain_custom_config(route.domain)
+        routes = db.get_routes_by_domain(route.domain)
+        if len(routes) == 0:
+            db.delete_domain_custom_config(route.domain)
+    nginx_app.nginx_utils.dirty_domains.mark(route.domain)
 
     return {"message": "Route deleted successfully"}
 
+@nginx_app.get("/metrics", tags=["metrics"], response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@nginx_app.get("/database/stats", tags=["database"])
+def get_database_stats():
+    return db.pool_stats()
+
+@nginx_app.get("/health/routes", tags=["health"])
+def get_routes_health():
+    if not nginx_app.health_prober:
+        raise HTTPException(status_code=404, detail="Health probes are disabled")
+    return {"routes": nginx_app.health_prober.get_health()}
+
+@nginx_app.get("/health/routes/{id}", tags=["health"])
+def get_route_health(id: int):
+    if not nginx_app.health_prober:
+        raise HTTPException(status_code=404, detail="Health probes are disabled")
+    health = nginx_app.health_prober.get_health(id)
+    if not health:
+        raise HTTPException(status_code=404, detail="Route not probed")
+    return health[0]
+
 @nginx_app.get("/nginx_status", tags=["nginx"])
-def get_nginx_status():
-    return nginx_app.docker_utils.get_container_info(nginx_app.config.nginx.container_id)
+async def get_nginx_status():
+    return await nginx_app.docker_utils.get_container_info_async(nginx_app.config.nginx.container_id)
+
+@nginx_app.get("/nginx_status/nodes", tags=["nginx"])
+async def get_nginx_nodes_status():
+    if not nginx_app.nginx_fleet:
+        raise HTTPException(status_code=404, detail="No nginx nodes configured")
+    containers = await nginx_app.nginx_fleet.get_containers()
+    nodes = nginx_app.nginx_fleet.get_status(dict(nginx_app.nginx_utils.config_hashes))
+    return {"nodes": [{**node, "state": containers[node["name"]]} for node in nodes]}
+
+def push_nginx_config():
+    start = time.perf_counter()
+    status = "failed"
+    try:
+        result = _push_nginx_config()
+        reload = result["reload"] or {}
+        status = "invalid" if reload.get("valid") is False else "partial" if reload.get("failed_nodes") else "done"
+        return result
+    finally:
+        duration = time.perf_counter() - start
+        metrics.PUSH_STAGE_SECONDS.observe(duration, stage="total")
+        metrics.LAST_PUSH_SECONDS.set(duration)
+        metrics.LAST_PUSH_TIMESTAMP.set(time.time())
+        metrics.PUSHES.inc(status=status)
+
+def _push_nginx_config():
+    nginx_utils = nginx_app.nginx_utils
+    all_domains, dirty_domains = nginx_utils.dirty_domains.pop()
+    try:
+        # In resolver mode nginx does not need the containers to exist to load the config
+        if nginx_app.config.nginx.upstream_mode != UpstreamMode.resolver:
+            routes = db.get_all_routes()
+            if nginx_app.docker_events and nginx_app.docker_events.watching and not all_domains:
+                # The docker events watcher keeps the routes it has seen in sync with the containers, the routes
+                # created or changed since the last push are only in the dirty domains and still have to be checked
+                routes = [route for route in routes if route.domain in dirty_domains]
+            with metrics.PUSH_STAGE_SECONDS.time(stage="verify"):
+                deactivated = nginx_app.docker_utils.verify_dockers(routes)
+            dirty_domains |= {route.domain for route in deactivated}
+        with metrics.PUSH_STAGE_SECONDS.time(stage="db"):
+            grouped = db.get_routes_grouped_by_domain(None if all_domains else sorted(dirty_domains))
+    except Exception:
+        nginx_utils.dirty_domains.restore(all_domains, dirty_domains)
+        raise
+    domains = list(grouped)
+    try:
+        with metrics.PUSH_STAGE_SECONDS.time(stage="render"):
+            for domain, group in grouped.items():
+                nginx_utils.update_nginx_config(domain, group["custom_config"], group["routes"])
+            # The last route of these domains was deleted, their files go away with this generation
+            for domain in sorted(dirty_domains - set(grouped)):
+                nginx_utils.remove_nginx_config(domain)
+            routes = db.get_all_routes()
+            replicas = {}
+            if nginx_app.config.nginx.upstream_replicas and nginx_utils.upstream_mode == UpstreamMode.upstream:
+                replicas = nginx_app.docker_utils.get_service_replicas({route.container_id for route in routes if route.enabled and route.container_id})
+            nginx_utils.update_shared_config(routes, replicas)
+        with metrics.PUSH_STAGE_SECONDS.time(stage="write"):
+            files = nginx_utils.commit_config()
+    except Exception:
+        nginx_utils.discard_config()
+        nginx_utils.dirty_domains.restore(all_domains, dirty_domains)
+        raise
+
+    reload = None
+    if nginx_app.nginx_fleet:
+        # The nodes keep track of the files they have, the ones that missed a push get them now even if nothing changed
+        with metrics.PUSH_STAGE_SECONDS.time(stage="reload"):
+            reload = nginx_app.nginx_fleet.push(dict(nginx_utils.config_hashes))
+        # The nodes rejecting the generation put back their own files, config_path keeps what the other nodes run
+        nginx_utils.reload_pending = False
+    elif nginx_utils.reload_pending:
+        with metrics.PUSH_STAGE_SECONDS.time(stage="reload"):
+            reload = nginx_app.docker_utils.reload_nginx(nginx_app.config.nginx.container_id, nginx_app.config.nginx.reload_mode)
+        if reload["valid"] is False:
+            # nginx keeps running the previous generation, put its files back
+            reload["rolled_back"] = nginx_utils.rollback_config()
+        else:
+            nginx_utils.reload_pending = not reload["reloaded"]
+    return {"message": "Nginx config updated successfully", "domains": domains, "files": files, "reload": reload}
 
 @nginx_app.post("/update_nginx_config", tags=["nginx"])
-def update_nginx_config():
-    nginx_app.docker_utils.verify_dockers(db.get_all_routes())
-
-    domains = db.get_domains()
-    for domain in domains:
-        domain_config = db.get_domain_custom_config(domain)
-        nginx_app.nginx_utils.update_nginx_config(domain, domain_config, db.get_routes_by_domain(domain))
-    
-    nginx_app.docker_utils.restart_container(nginx_app.config.nginx.container_id)
-    return {"message": "Nginx config updated successfully"}
\ No newline at end of file
+def update_nginx_config(wait: bool = False, timeout: float = 120):
+    # Pushes are coalesced by the scheduler, the job can be polled or waited for
+    job = nginx_app.push_scheduler.request()
+    if not wait:
+        return {"message": "Nginx config update scheduled", "job": job}
+    job = nginx_app.push_scheduler.wait(job["id"], timeout)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Nginx config update job not found")
+    if job["status"] in ("pending", "running"):
+        # Still in progress after the timeout, it can be polled with its id
+        return JSONResponse(status_code=202, content={"message": "Nginx config update still in progress", "job": job})
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail={"message": "Nginx config update failed", "job": job})
+    if job["result"] and job["result"]["reload"] and job["result"]["reload"]["valid"] is False:
+        raise HTTPException(status_code=422, detail={"message": "Nginx config test failed", "job": job})
+    if job["result"] and job["result"]["reload"] and job["result"]["reload"].get("failed_nodes"):
+        raise HTTPException(status_code=502, detail={"message": "Nginx config update failed on some nodes", "job": job})
+    return {"message": "Nginx config updated successfully", "job": job}
+
+@nginx_app.get("/update_nginx_config/{job_id}", tags=["nginx"])
+def get_nginx_config_job(job_id: str):
+    job = nginx_app.push_scheduler.get(job_id)
+    if job:
+        return {"job": job}
+    raise HTTPException(status_code=404)
@@ -0,0 +1,139 @@
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+        if not labels and self.type in ("counter", "gauge"):
+            self._values[()] = 0
+
+    def _key(self, labels: dict):
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _format_labels(self, key: tuple, extra: str = ""):
+        pairs = [f'{label}="{value}"' for label, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{self._format_labels(key)} {value}")
+        return lines
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{self._format_labels(key, le)} {bucket_count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{self._format_labels(key, le)} {count}")
+                lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+def timed(histogram: Histogram, **labels):
+    # Decorator observing the duration of sync and async functions
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with histogram.time(**labels):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def instrument_methods(histogram: Histogram, label: str, exclude: tuple[str, ...] = ()):
+    # Class decorator timing every public method, labelled with the method name
+    def decorator(cls):
+        for name, function in list(vars(cls).items()):
+            if name.startswith("_") or name in exclude or not inspect.isfunction(function):
+                continue
+            setattr(cls, name, timed(histogram, **{label: name})(function))
+        return cls
+    return decorator
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+DB_QUERY_SECONDS = Histogram("pruminx_db_query_seconds", "Duration of the Database methods", ("method",))
+DOCKER_ENGINE_SECONDS = Histogram("pruminx_docker_engine_seconds", "Duration of the calls to the docker engine", ("call",))
+NGINX_CONFIG_SECONDS = Histogram("pruminx_nginx_config_seconds", "Duration of rendering and writing the nginx config files", ("operation",))
+PUSH_STAGE_SECONDS = Histogram("pruminx_push_stage_seconds", "Duration of each stage of a config push", ("stage",))
+ROUTES_RENDERED = Counter("pruminx_routes_rendered_total", "Routes rendered into nginx config files")
+ROUTES_DEACTIVATED = Counter("pruminx_routes_deactivated_total", "Routes deactivated by the container checks")
+FILES_WRITTEN = Counter("pruminx_config_files_written_total", "Nginx config files written")
+HEALTH_PROBES = Counter("pruminx_health_probes_total", "Health probes of the routes by result", ("result",))
+NODE_PUSH_SECONDS = Histogram("pruminx_node_push_seconds", "Duration of the config push to each nginx node", ("node",))
+NODE_PUSHES = Counter("pruminx_node_pushes_total", "Config pushes to each nginx node by result", ("node", "status"))
+PUSHES = Counter("pruminx_pushes_total", "Config pushes by result", ("status",))
+LAST_PUSH_SECONDS = Gauge("pruminx_last_push_duration_seconds", "Duration of the last config push")
+LAST_PUSH_TIMESTAMP = Gauge("pruminx_last_push_timestamp_seconds", "Unix time of the end of the last config push")
+
+REGISTRY = [
+    DB_QUERY_SECONDS, DOCKER_ENGINE_SECONDS, NGINX_CONFIG_SECONDS, PUSH_STAGE_SECONDS,
+    ROUTES_RENDERED, ROUTES_DEACTIVATED, FILES_WRITTEN, HEALTH_PROBES, NODE_PUSH_SECONDS, NODE_PUSHES, PUSHES, LAST_PUSH_SECONDS, LAST_PUSH_TIMESTAMP,
+]
@@ -1,6 +1,10 @@
+import posixpath
+import re
+from typing import TextIO
+from schema import NginxRoute, ProxyType, UpstreamMode
 
 def _get_server_regex(server_name: str):
-    return "~^(www\.)?{}".format(server_name.replace(".", "\\."))
+    return "~^(www\\.)?{}".format(server_name.replace(".", "\\."))
 
 def config_lines(is_default: bool = False, server_name: str = None, ssl_certificate: str = "", ssl_certificate_key: str = ""):
     server_name_field = "server_name " + _get_server_regex(server_name) + ";" if server_name and server_name != "default" else ""
@@ -16,25 +20,127 @@ def config_lines(is_default: bool = False, server_name: str = None, ssl_certific
 \tclient_max_body_size 200M;
 """
 
+# Templates are bound once, rendering only fills them and writes the result to the output buffer
+_CONFIG_FILE_HEAD = "\nserver {{\n{}\n{}\n".format
+_CONFIG_FILE_TAIL = "\n}"
+_ROUTE_TEMPLATE = "\n\tlocation {} {{\n    \tproxy_pass http://{}:{}{};\n    \tproxy_set_header Host $http_host;\n    \t{}\n\t}}\n    ".format
+
+# Locations proxying to a named upstream reuse its keepalive connections, they need HTTP/1.1 without "Connection: close"
+_UPSTREAM_ROUTE_TEMPLATE = "\n\tlocation {} {{\n    \tproxy_pass http://{}{};\n    \tproxy_http_version 1.1;\n    \tproxy_set_header Connection \"\";\n    \tproxy_set_header Host $http_host;\n    \t{}\n\t}}\n    ".format
+_UPSTREAM_TEMPLATE = "\nupstream {} {{\n{}\tkeepalive {};\n}}\n".format
+_UPSTREAM_SERVER_TEMPLATE = "\tserver {}:{};\n".format
+
+# Names in a variable are resolved by nginx on each request (cached for the resolver valid time) instead of at startup,
+# so a missing container fails its own requests and not the whole config
+# The variable holding the container and port of a resolver route, also read back by nginx_importer
+RESOLVER_VARIABLE = "$pruminx_upstream"
+_RESOLVER_TEMPLATE = "\tresolver {};\n".format
+_RESOLVER_ROUTE_TEMPLATE = "\n\tlocation {} {{\n    \tset $pruminx_upstream {}:{};\n    \t{}proxy_pass http://$pruminx_upstream;\n    \tproxy_set_header Host $http_host;\n    \t{}\n\t}}\n    ".format
+# proxy_pass with a variable does not replace the location prefix by its URI, the rewrite does it
+_RESOLVER_REWRITE_TEMPLATE = "rewrite \"^{}(.*)$\" \"{}$1\" break;\n    \t".format
+
+_POLICY_LINE = "{};\n    \t".format
+COMPRESSED_TYPES = "text/plain text/css text/xml application/json application/javascript application/xml image/svg+xml"
+_CACHE_PATH_TEMPLATE = "\nproxy_cache_path {}{} levels=1:2 keys_zone={}:{} max_size={} inactive={} use_temp_path=off;\n".format
+
+def get_route_policy(route: NginxRoute):
+    # Directives of the typed caching and compression fields, written before the custom config of the location
+    lines = []
+    if route.cache_zone:
+        lines.append(f"proxy_cache {route.cache_zone}")
+        if route.cache_ttl:
+            lines.append(f"proxy_cache_valid 200 301 302 {route.cache_ttl}")
+    if route.gzip is not None:
+        lines.append("gzip on" if route.gzip else "gzip off")
+        if route.gzip:
+            lines.append(f"gzip_types {COMPRESSED_TYPES}")
+    if route.brotli is not None:
+        lines.append("brotli on" if route.brotli else "brotli off")
+        if route.brotli:
+            lines.append(f"brotli_types {COMPRESSED_TYPES}")
+    if route.expires:
+        lines.append(f"expires {route.expires}")
+    if route.proxy_buffering is not None:
+        lines.append("proxy_buffering on" if route.proxy_buffering else "proxy_buffering off")
+    return "".join(_POLICY_LINE(line) for line in lines)
+
+def _get_location_config(route: NginxRoute):
+    return f"{get_route_policy(route)}{route.custom_config}"
+
+# Static files are sent by the kernel straight from the page cache, with their descriptors and the precompressed
+# .gz siblings looked up once and cached
+_STATIC_ROUTE_TEMPLATE = "\n\tlocation {} {{\n    \talias {};\n    \tsendfile on;\n    \ttcp_nopush on;\n    \topen_file_cache max=1000 inactive=60s;\n    \topen_file_cache_valid 60s;\n    \topen_file_cache_errors on;\n    \tgzip_static on;\n    \t{}\n\t}}\n    ".format
+
+def get_static_alias(static_root: str, static_path: str | None):
+    # static_path is relative to the static root, normalizing it as an absolute path drops any ".." above the root
+    path = posixpath.normpath("/" + (static_path or ""))
+    return static_root.rstrip("/") + path.rstrip("/") + "/"
+
+def get_upstream_name(container_id: str, port: int):
+    # One upstream per container and port, shared by every route pointing to them
+    return "pruminx_{}_{}".format(re.sub(r"[^A-Za-z0-9_.-]", "_", container_id), port)
+
 def generate_config_file(server_config: str, routes_config: list[str] = [], warn_message: str = ""):
-    config = f"""
-server {{
-{warn_message}
-{server_config}
-{"\n".join(routes_config)}
-}}"""
-    return config
-
-def _get_path(path: str):
+    return _CONFIG_FILE_HEAD(warn_message, server_config) + "\n".join(routes_config) + _CONFIG_FILE_TAIL
+
+def write_config_file(out: TextIO, server_config: str, routes: list[NginxRoute], warn_message: str = "",
+                      upstream_mode: UpstreamMode = UpstreamMode.direct, resolver: str = "", static_root: str = ""):
+    # Same output as generate_config_file with the generate_route_config of every enabled route.
+    # In upstream mode the routes proxy to the blocks written by write_upstreams_file instead of the container,
+    # in resolver mode the container is resolved by nginx when the requests arrive. Static routes serve the files
+    # under static_root
+    out.write(_CONFIG_FILE_HEAD(warn_message, server_config))
+    if upstream_mode == UpstreamMode.resolver:
+        out.write(_RESOLVER_TEMPLATE(resolver))
+    for index, route in enumerate(routes):
+        if index:
+            out.write("\n")
+        if not route.enabled:
+            continue
+        if route.proxy_type == ProxyType.static:
+            out.write(_STATIC_ROUTE_TEMPLATE(get_location_path(route.path), get_static_alias(static_root, route.static_path), _get_location_config(route)))
+        elif upstream_mode == UpstreamMode.direct or not (route.container_id and route.port):
+            out.write(_ROUTE_TEMPLATE(get_location_path(route.path), route.container_id, route.port, _get_target_path(route.target_path), _get_location_config(route)))
+        elif upstream_mode == UpstreamMode.upstream:
+            out.write(_UPSTREAM_ROUTE_TEMPLATE(get_location_path(route.path), get_upstream_name(route.container_id, route.port), _get_target_path(route.target_path), _get_location_config(route)))
+        else:
+            out.write(_RESOLVER_ROUTE_TEMPLATE(get_location_path(route.path), route.container_id, route.port, get_resolver_rewrite(route), _get_location_config(route)))
+    out.write(_CONFIG_FILE_TAIL)
+
+def get_resolver_rewrite(route: NginxRoute):
+    path = get_location_path(route.path)
+    target_path = _get_target_path(route.target_path)
+    # Regex and named locations can not have a URI in proxy_pass either, they are passed as they are
+    if not target_path or path[0] in "~@":
+        return ""
+    if path.startswith("= ") or path.startswith("^~ "):
+        path = path.split(" ", 1)[1]
+    return _RESOLVER_REWRITE_TEMPLATE(re.escape(path).replace('"', '\\"'), target_path.replace('"', '\\"'))
+
+def write_cache_zones(out: TextIO, routes: list[NginxRoute], cache_path: str, keys_size: str, max_size: str, inactive: str):
+    # http level proxy_cache_path of every zone used by an enabled route, each zone is declared once
+    zones = sorted({route.cache_zone for route in routes if route.enabled and route.cache_zone})
+    for zone in zones:
+        out.write(_CACHE_PATH_TEMPLATE(cache_path, zone, zone, keys_size, max_size, inactive))
+
+def write_upstreams_file(out: TextIO, routes: list[NginxRoute], keepalive: int, replicas: dict[str, list[str]] = {}):
+    # http level blocks for every container and port used by an enabled route. replicas maps a container to
+    # every container of its compose service, all of them are listed as servers of the upstream
+    upstreams = {}
+    for route in routes:
+        if route.enabled and route.container_id and route.port:
+            upstreams.setdefault(get_upstream_name(route.container_id, route.port), (route.container_id, route.port))
+    for name, (container_id, port) in sorted(upstreams.items()):
+        servers = "".join(_UPSTREAM_SERVER_TEMPLATE(server, port) for server in replicas.get(container_id) or [container_id])
+        out.write(_UPSTREAM_TEMPLATE(name, servers, keepalive))
+
+def get_location_path(path: str):
     return f"{path}" if path[-1] == "/" else f"{path}/"
 
-def generate_route_config(path: str, container_id: str, port: int, custom_config: str | None = None, target_path: str | None = None):
-    print(path, container_id, port)
-    config = f"""
-\tlocation {_get_path(path)} {{
-    \tproxy_pass http://{container_id}:{port}{target_path if target_path and target_path[0] == "/" else "/" + target_path if target_path else ""};
-    \tproxy_set_header Host $http_host;
-    \t{custom_config}
-\t}}
-    """
-    return config 
\ No newline at end of file
+def _get_target_path(target_path: str | None):
+    if not target_path:
+        return ""
+    return target_path if target_path[0] == "/" else "/" + target_path
+
+def generate_route_config(path: str, container_id: str, port: int, custom_config: str | None = None, target_path: str | None = None, route_policy: str = ""):
+    return _ROUTE_TEMPLATE(get_location_path(path), container_id, port, _get_target_path(target_path), f"{route_policy}{custom_config}")
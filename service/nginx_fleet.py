@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import io
+import os
+import tarfile
+import threading
+import time
+import docker
+from async_docker import AsyncDockerClient
+from docker_utils import nginx_reload_steps
+from schema import NginxNode, ReloadMode
+from metrics import NODE_PUSH_SECONDS, NODE_PUSHES
+
+class NginxFleet:
+    # Copies each generation rendered in config_path to the nginx container of every node and reloads them in
+    # parallel, so a push takes about as long as the slowest node. The hashes of the files each node has are kept
+    # to only send the files that changed, a node that fails a push gets every file again on the next one.
+    # A node rejecting a generation gets back the files it had before, the rest of the nodes keep running it.
+    def __init__(self, nodes: list[NginxNode], reload_mode: ReloadMode = ReloadMode.reload):
+        self.nodes = nodes
+        self.reload_mode = reload_mode
+        self._lock = threading.Lock()
+        self._hashes = {node.name: {} for node in nodes}
+        self._results = {node.name: None for node in nodes}
+        # Contents of the files run by some node by their hash, to put them back without downloading them
+        self._contents = {}
+
+    def push(self, files: dict[str, str]):
+        # files are the hashes of every generated file, the files sent before and missing from them are removed (None)
+        changed = {
+            node.name: {
+                **{path: file_hash for path, file_hash in files.items() if self._hashes[node.name].get(path) != file_hash},
+                **{path: None for path in self._hashes[node.name] if path not in files},
+            }
+            for node in self.nodes
+        }
+        if not any(changed.values()):
+            return None
+        start = time.perf_counter()
+        # The files are read and archived once, nodes missing the same files share the archive
+        contents = {}
+        for path in set().union(*changed.values()) & set(files):
+            with open(path, "rb") as f:
+                contents[path] = f.read()
+        archives = {}
+        for paths in changed.values():
+            key = self._archive_key(paths)
+            if key and key not in archives:
+                archives[key] = self._archive({os.path.basename(path): contents[path] for path in key})
+        results = asyncio.run(self._push_all(changed, archives))
+        known = {**self._contents, **{files[path]: data for path, data in contents.items()}}
+        referenced = {file_hash for hashes in self._hashes.values() for file_hash in hashes.values()}
+        self._contents = {file_hash: data for file_hash, data in known.items() if file_hash in referenced}
+        rejected = [result["node"] for result in results if result["valid"] is False]
+        failed = [result["node"] for result in results if result["status"] not in ("done", "unchanged")]
+        tested = [result["valid"] for result in results if result["valid"] is not None]
+        return {
+            "mode": self.reload_mode.value,
+            "valid": False if rejected else (True if tested else None),
+            "output": "".join(f"[{result['node']}] {result['output']}" for result in results if result["output"]),
+            "reloaded": any(result["reloaded"] for result in results),
+            "latency_ms": (time.perf_counter() - start) * 1000,
+            "nodes": results,
+            "failed_nodes": failed,
+        }
+
+    async def _push_all(self, changed: dict[str, dict[str, str]], archives: dict[tuple, bytes]):
+        return await asyncio.gather(*[
+            self._push_node(node, changed[node.name], archives.get(self._archive_key(changed[node.name])))
+            for node in self.nodes
+        ])
+
+    @staticmethod
+    def _archive_key(changed: dict[str, str | None]):
+        return tuple(sorted(path for path, file_hash in changed.items() if file_hash))
+
+    async def _push_node(self, node: NginxNode, changed: dict[str, str | None], archive: bytes | None):
+        start = time.perf_counter()
+        result = {"node": node.name, "status": "unchanged", "files": len(changed), "mode": None, "valid": None,
+                  "output": "", "reloaded": False, "rolled_back": [], "error": None}
+        if changed:
+            # Until the node confirms the generation its copies of the changed files are unknown
+            previous = {path: self._hashes[node.name].pop(path, None) for path in changed}
+            client = AsyncDockerClient(node.base_url, node.max_connections, node.timeout)
+            try:
+                await asyncio.wait_for(self._sync_node(client, node, changed, archive, previous, result), node.timeout)
+            except asyncio.TimeoutError:
+                result["status"], result["error"] = "timeout", f"Push to {node.name} timed out after {node.timeout}s"
+            except docker.errors.DockerException as e:
+                result["status"], result["error"] = "failed", str(e)
+            finally:
+                await client.aclose()
+            if result["status"] == "done":
+                self._hashes[node.name].update({path: file_hash for path, file_hash in changed.items() if file_hash})
+            elif result["status"] != "invalid":
+                # The node may have been left with any mix of files
+                self._hashes[node.name] = {}
+            duration = time.perf_counter() - start
+            NODE_PUSH_SECONDS.observe(duration, node=node.name)
+            NODE_PUSHES.inc(node=node.name, status=result["status"])
+        result["latency_ms"] = (time.perf_counter() - start) * 1000
+        if result["error"]:
+            print(f"Error pushing the nginx config to {node.name}: {result['error']}")
+        with self._lock:
+            self._results[node.name] = {**result, "finished_at": time.time()}
+        return result
+
+    async def _sync_node(self, client: AsyncDockerClient, node: NginxNode, changed: dict[str, str | None], archive: bytes | None,
+                         previous: dict[str, str | None], result: dict):
+        backup = await self._get_backup(client, node, previous)
+        if archive:
+            await client.put_archive(node.container_id, node.config_path, archive)
+        removed = [node.config_path + os.path.basename(path) for path, file_hash in changed.items() if not file_hash]
+        if removed:
+            await client.exec_run(node.container_id, ["rm", "-f", *removed])
+        result.update(await self._reload(client, node))
+        if result["valid"] is False:
+            # nginx keeps running the previous generation, put its files back
+            result["rolled_back"] = await self._restore(client, node, backup)
+            result["status"] = "invalid"
+        elif result["reloaded"]:
+            result["status"] = "done"
+        else:
+            result["status"] = "failed"
+
+    async def _get_backup(self, client: AsyncDockerClient, node: NginxNode, previous: dict[str, str | None]):
+        # Contents the node has of the files about to be replaced, None for the files it does not have
+        backup = {path: self._contents[file_hash] for path, file_hash in previous.items() if file_hash in self._contents}
+        unknown = [path for path in previous if path not in backup]
+        if len(unknown) > node.max_connections:
+            # A node that missed pushes, the whole config folder is downloaded at once
+            try:
+                files = self._extract(await client.get_archive(node.container_id, node.config_path))
+            except docker.errors.NotFound:
+                files = {}
+            backup.update({path: files.get(os.path.basename(path)) for path in unknown})
+        elif unknown:
+            async def download(path: str):
+                try:
+                    files = self._extract(await client.get_archive(node.container_id, node.config_path + os.path.basename(path)))
+                except docker.errors.NotFound:
+                    return None
+                return files.get(os.path.basename(path))
+            backup.update(zip(unknown, await asyncio.gather(*[download(path) for path in unknown])))
+        return backup
+
+    async def _reload(self, client: AsyncDockerClient, node: NginxNode):
+        # Same steps as DockerUtils.reload_nginx, run through the engine of the node
+        steps = nginx_reload_steps(self.reload_mode, f"Nginx on {node.name}")
+        value, error = None, None
+        while True:
+            try:
+                step = steps.throw(error) if error else steps.send(value)
+            except StopIteration as stop:
+                return stop.value
+            value, error = None, None
+            try:
+                if step[0] == "status":
+                    value = (await client.inspect_container(node.container_id))["State"]["Status"]
+                elif step[0] == "exec":
+                    value = await client.exec_run(node.container_id, step[1])
+                else:
+                    await client.restart_container(node.container_id)
+            except docker.errors.APIError as e:
+                error = e
+
+    async def _restore(self, client: AsyncDockerClient, node: NginxNode, backup: dict[str, bytes | None]):
+        replaced = {os.path.basename(path): data for path, data in backup.items() if data is not None}
+        if replaced:
+            await client.put_archive(node.container_id, node.config_path, self._archive(replaced))
+        created = [node.config_path + os.path.basename(path) for path, data in backup.items() if data is None]
+        if created:
+            await client.exec_run(node.container_id, ["rm", "-f", *created])
+        # The node runs these files again
+        for path, data in backup.items():
+            if data is not None:
+                file_hash = hashlib.sha256(data).hexdigest()
+                self._contents[file_hash] = data
+                self._hashes[node.name][path] = file_hash
+        return sorted(backup)
+
+    @staticmethod
+    def _extract(archive: bytes):
+        # Regular files of an archive of the engine, by name. Archives of a folder have it as the first path component
+        files = {}
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            for member in tar:
+                if member.isfile():
+                    files[member.name.rsplit("/", 1)[-1]] = tar.extractfile(member).read()
+        return files
+
+    @staticmethod
+    def _archive(files: dict[str, bytes]):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            for name, data in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = 0o644
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+        return buffer.getvalue()
+
+    def get_status(self, files: dict[str, str]):
+        with self._lock:
+            return [
+                {
+                    "name": node.name,
+                    "base_url": node.base_url,
+                    "container_id": node.container_id,
+                    "config_path": node.config_path,
+                    "in_sync": self._hashes[node.name] == files,
+                    "last_push": self._results[node.name],
+                }
+                for node in self.nodes
+            ]
+
+    async def get_containers(self):
+        # State of the nginx container of every node, None for the nodes that can not be reached
+        async def inspect(node: NginxNode):
+            client = AsyncDockerClient(node.base_url, 1, node.timeout)
+            try:
+                return (await asyncio.wait_for(client.inspect_container(node.container_id), node.timeout))["State"]
+            except (asyncio.TimeoutError, docker.errors.DockerException) as e:
+                print(f"Error inspecting the nginx container of {node.name}: {e}")
+                return None
+            finally:
+                await client.aclose()
+        return dict(zip([node.name for node in self.nodes], await asyncio.gather(*[inspect(node) for node in self.nodes])))
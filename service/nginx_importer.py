@@ -0,0 +1,339 @@
+import glob
+import json
+import os
+import re
+import sys
+import time
+from urllib.parse import urlsplit
+from nginx_config import COMPRESSED_TYPES, RESOLVER_VARIABLE, get_location_path, get_resolver_rewrite
+from schema import NginxRoute, ProxyType
+
+TOKEN_RE = re.compile(r'''\s+|#[^\n]*|[{};]|"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|(?:\$\{[^}]*\}|[^\s{};"'#])(?:\$\{[^}]*\}|[^\s{};"'])*''')
+# Fields of the routes read from the config files, the rest of the fields of existing routes are kept
+IMPORTED_FIELDS = ("proxy_type", "container_id", "port", "target_path", "static_path", "custom_config",
+                   "cache_zone", "cache_ttl", "gzip", "brotli", "expires", "proxy_buffering")
+# Directives written by nginx_config for every route, they are not part of the custom config of the routes
+GENERATED_DIRECTIVES = [
+    ("proxy_set_header", ["Host", "$http_host"]),
+    ("proxy_http_version", ["1.1"]),
+    ("proxy_set_header", ["Connection", ""]),
+    ("sendfile", ["on"]),
+    ("tcp_nopush", ["on"]),
+    ("open_file_cache", ["max=1000", "inactive=60s"]),
+    ("open_file_cache_valid", ["60s"]),
+    ("open_file_cache_errors", ["on"]),
+    ("gzip_static", ["on"]),
+    ("gzip_types", COMPRESSED_TYPES.split()),
+    ("brotli_types", COMPRESSED_TYPES.split()),
+]
+
+# Names of the upstreams written by nginx_config.get_upstream_name. Container names and ids only use the characters
+# kept by the name, so the container and the port are read back from it
+UPSTREAM_NAME_RE = re.compile(r"^pruminx_([A-Za-z0-9_.-]+)_([0-9]+)$")
+
+class Directive:
+    __slots__ = ("name", "args", "start", "end", "children", "body_start", "body_end")
+
+    def __init__(self, name: str, args: list[str], start: int):
+        self.name = name
+        self.args = args
+        self.start = start
+        self.end = start
+        self.children = None
+        self.body_start = None
+        self.body_end = None
+
+def _tokenize(text: str):
+    for match in TOKEN_RE.finditer(text):
+        token = match.group()
+        if token[0].isspace() or token[0] == "#":
+            continue
+        if token[0] in "\"'" and len(token) > 1:
+            token = token[1:-1]
+        yield token, match.start(), match.end()
+
+def parse(text: str):
+    # Returns the top level directives, blocks keep the offsets of their body in the text
+    root = []
+    stack = [root]
+    parents = []
+    current = None
+    for token, start, end in _tokenize(text):
+        if token == "{" and current is not None:
+            current.children = []
+            current.body_start = end
+            stack[-1].append(current)
+            stack.append(current.children)
+            parents.append(current)
+            current = None
+        elif token == ";" and current is not None:
+            current.end = end
+            stack[-1].append(current)
+            current = None
+        elif token == "}" and parents:
+            # A directive without its ";" (like the "None" of routes without custom config) ends with the block
+            current = None
+            block = parents.pop()
+            block.body_end = start
+            block.end = end
+            stack.pop()
+        elif current is None:
+            current = Directive(token, [], start)
+        else:
+            current.args.append(token)
+    return root
+
+def _find_servers(directives: list[Directive]):
+    for directive in directives:
+        if directive.children is None:
+            continue
+        if directive.name == "server":
+            yield directive
+        else:
+            yield from _find_servers(directive.children)
+
+def _get_domain(server: Directive):
+    for directive in server.children:
+        if directive.name == "server_name" and directive.args:
+            name = directive.args[0]
+            if name.startswith("~"):
+                # Regex generated by nginx_config._get_server_regex
+                name = name.lstrip("~").lstrip("^").replace("(www\\.)?", "").rstrip("$").replace("\\.", ".")
+            return name[4:] if name.startswith("www.") else name
+    return "default"
+
+def _get_domain_config(text: str, server: Directive, warn_message: str):
+    body = text[server.body_start:server.body_end]
+    offset = server.body_start
+    prefix = "\n" + warn_message + "\n"
+    generated = warn_message and body.startswith(prefix)
+    removed = [directive for directive in server.children if directive.name == "location"]
+    others = [directive for directive in server.children if directive.name != "location"]
+    if generated and others and others[-1].name == "resolver":
+        # Written after the server config in resolver mode, it is rendered again by write_config_file
+        removed.append(others[-1])
+    for directive in sorted(removed, key=lambda directive: directive.start, reverse=True):
+        body = body[:directive.start - offset] + body[directive.end - offset:]
+    if generated:
+        # Written by generate_config_file: the server config is kept as it was
+        config = body[len(prefix):].rstrip()
+    else:
+        config = "\n".join(line for line in body.splitlines() if line.strip())
+        config = "\n" + config if config else ""
+    if config == "None":
+        return None
+    return config + "\n" if config else ""
+
+def _get_policy(directive: Directive, policy: dict):
+    # Reads back the directives written by nginx_config.get_route_policy into the typed fields
+    args = directive.args
+    if directive.name == "proxy_cache" and len(args) == 1:
+        policy["cache_zone"] = args[0]
+    elif directive.name == "proxy_cache_valid" and args[:-1] == ["200", "301", "302"]:
+        policy["cache_ttl"] = args[-1]
+    elif directive.name in ("gzip", "brotli", "proxy_buffering") and args in (["on"], ["off"]):
+        policy[directive.name] = args[0] == "on"
+    elif directive.name == "expires" and args:
+        policy["expires"] = " ".join(args)
+    else:
+        return False
+    return True
+
+def _get_upstream(netloc: str, variables: dict[str, str]):
+    # Returns the container and the port of a proxy_pass host of any upstream mode
+    netloc = variables.get(netloc, netloc)
+    upstream = UPSTREAM_NAME_RE.match(netloc)
+    if upstream:
+        return upstream.group(1), int(upstream.group(2))
+    host, _, port = netloc.rpartition(":")
+    if not host or not port.isdigit():
+        return None, None
+    return host, int(port)
+
+def _get_rewrite_target(text: str, path: str, rewrite: Directive | None):
+    # target_path of the rewrite written by nginx_config.get_resolver_rewrite, None for any other rewrite
+    if rewrite is None or len(rewrite.args) != 3 or not rewrite.args[1].endswith("$1"):
+        return None
+    target_path = rewrite.args[1][:-2].replace('\\"', '"')
+    expected = get_resolver_rewrite(NginxRoute(proxy_type=ProxyType.docker, path=path, target_path=target_path))
+    return target_path if expected and text[rewrite.start:rewrite.end] == expected[:expected.rindex(";") + 1] else None
+
+def _get_route(text: str, domain: str, location: Directive, static_root: str):
+    proxy_pass = None
+    alias = None
+    rewrite = None
+    variables = {}
+    removed = []
+    policy = {}
+    for directive in location.children or []:
+        if directive.name == "proxy_pass" and directive.args and proxy_pass is None:
+            proxy_pass = directive.args[0]
+            removed.append(directive)
+        elif directive.name == "set" and directive.args[:1] == [RESOLVER_VARIABLE] and len(directive.args) == 2:
+            variables[RESOLVER_VARIABLE] = directive.args[1]
+            removed.append(directive)
+        elif directive.name == "rewrite" and rewrite is None:
+            rewrite = directive
+        elif directive.name in ("alias", "root") and directive.args and alias is None:
+            alias = directive.args[0] if directive.name == "alias" else directive.args[0].rstrip("/") + get_location_path(" ".join(location.args))
+            removed.append(directive)
+        elif (directive.name, directive.args) in GENERATED_DIRECTIVES:
+            removed.append(directive)
+        elif _get_policy(directive, policy):
+            removed.append(directive)
+    if not location.args:
+        return None
+    if proxy_pass is not None:
+        url = urlsplit(proxy_pass)
+        container_id, port = _get_upstream(url.netloc, variables)
+        if not container_id:
+            return None
+        target_path = url.path
+        if url.netloc in variables:
+            # proxy_pass with a variable carries no URI, the generated rewrite has the target path
+            target_path = _get_rewrite_target(text, " ".join(location.args), rewrite)
+            if target_path is not None:
+                removed.append(rewrite)
+        route = {"proxy_type": ProxyType.docker, "container_id": container_id, "port": port, "target_path": target_path or ""}
+    elif alias is not None and static_root and alias.startswith(static_root.rstrip("/") + "/"):
+        # Files served from the static root of the nginx container, see nginx_config.get_static_alias
+        route = {"proxy_type": ProxyType.static, "static_path": alias[len(static_root.rstrip("/")):].strip("/")}
+    else:
+        return None
+    body = text[location.body_start:location.body_end]
+    offset = location.body_start
+    for directive in sorted(removed, key=lambda directive: directive.start, reverse=True):
+        body = body[:directive.start - offset] + body[directive.end - offset:]
+    custom_config = body.strip()
+    return NginxRoute(
+        domain=domain,
+        path=" ".join(location.args),
+        custom_config=None if custom_config == "None" else custom_config,
+        **route,
+        **policy,
+    )
+
+def parse_file(config_file_path: str, warn_message: str = "", static_root: str = ""):
+    # Yields (domain, domain_config, routes, skipped_locations) for every server block of the file
+    with open(config_file_path, "r", errors="replace") as f:
+        text = f.read()
+    for server in _find_servers(parse(text)):
+        domain = _get_domain(server)
+        routes = []
+        skipped = 0
+        for directive in server.children:
+            if directive.name == "location" and directive.children is not None:
+                route = _get_route(text, domain, directive, static_root)
+                if route:
+                    routes.append(route)
+                else:
+                    skipped += 1
+        yield domain, _get_domain_config(text, server, warn_message), routes, skipped
+
+def _is_inside(path: str, roots: list[str]):
+    return any(path == root or path.startswith(root.rstrip(os.sep) + os.sep) for root in roots)
+
+def resolve_import_path(path: str, roots: list[str]):
+    # Relative paths start at the first root, the path can not leave the roots. Returns None when it does
+    path = os.path.normpath(os.path.join(roots[0], path))
+    return path if _is_inside(path, [os.path.normpath(root) for root in roots]) else None
+
+def iter_config_files(path: str, roots: list[str] | None = None):
+    # Dot folders are skipped, like the staging and previous generations of ConfigWriter. With roots, the files
+    # reached through links out of them are skipped too
+    real_roots = [os.path.realpath(root) for root in roots] if roots else None
+    if os.path.isdir(path):
+        def walk():
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+                for name in sorted(files):
+                    if name.endswith(".conf"):
+                        yield os.path.join(root, name)
+        paths = walk()
+    else:
+        # glob does not match dot files and folders
+        paths = sorted(glob.iglob(path, recursive=True))
+    for config_file_path in paths:
+        if os.path.isfile(config_file_path) and (real_roots is None or _is_inside(os.path.realpath(config_file_path), real_roots)):
+            yield config_file_path
+
+def import_nginx_config(path: str, db, warn_message: str = "", dry_run: bool = True, static_root: str = "",
+                        roots: list[str] | None = None):
+    # Files are parsed one at a time, only the routes found are kept in memory. With roots only the files
+    # inside them are read
+    if roots:
+        resolved = resolve_import_path(path, roots)
+        if resolved is None:
+            raise ValueError(f"The path {path} is outside of the import folders: {', '.join(roots)}")
+        path = resolved
+    start = time.perf_counter()
+    stats = {"files": 0, "bytes": 0, "servers": 0, "locations": 0, "skipped_locations": 0, "errors": []}
+    domains = {}
+    routes = {}
+    for config_file_path in iter_config_files(path, roots):
+        try:
+            for domain, domain_config, server_routes, skipped in parse_file(config_file_path, warn_message, static_root):
+                stats["servers"] += 1
+                stats["skipped_locations"] += skipped
+                if server_routes and domain not in domains:
+                    domains[domain] = domain_config
+                for route in server_routes:
+                    stats["locations"] += 1
+                    # Rendered locations always end with a slash, see nginx_config.get_location_path
+                    routes.setdefault((route.domain, get_location_path(route.path)), route)
+            stats["bytes"] += os.path.getsize(config_file_path)
+            stats["files"] += 1
+        except (OSError, UnicodeError) as e:
+            stats["errors"].append({"file": config_file_path, "error": str(e)})
+    elapsed = time.perf_counter() - start
+    stats["parse_seconds"] = elapsed
+    stats["files_per_second"] = stats["files"] / elapsed if elapsed else None
+    stats["mb_per_second"] = stats["bytes"] / elapsed / 1_000_000 if elapsed else None
+
+    existing_routes = {(route.domain, get_location_path(route.path)): route for route in db.get_all_routes()}
+    existing_domains = db.get_domain_custom_configs()
+    diff = {"routes": {"add": [], "update": [], "unchanged": 0}, "domains": {"add": [], "update": [], "unchanged": 0}}
+    new_routes = []
+    updated_routes = []
+    for key, route in routes.items():
+        existing = existing_routes.get(key)
+        if existing is None:
+            diff["routes"]["add"].append(route.model_dump(mode="json"))
+            new_routes.append(route)
+        elif any(getattr(existing, field) != getattr(route, field) for field in IMPORTED_FIELDS):
+            updated = existing.model_copy(update={field: getattr(route, field) for field in IMPORTED_FIELDS})
+            diff["routes"]["update"].append({"before": existing.model_dump(mode="json"), "after": updated.model_dump(mode="json")})
+            updated_routes.append(updated)
+        else:
+            diff["routes"]["unchanged"] += 1
+    for domain, domain_config in domains.items():
+        if domain not in existing_domains:
+            diff["domains"]["add"].append(domain)
+        elif existing_domains[domain] != domain_config:
+            diff["domains"]["update"].append(domain)
+        else:
+            diff["domains"]["unchanged"] += 1
+
+    if not dry_run:
+        with db.transaction():
+            for domain in diff["domains"]["add"]:
+                db.add_domain_custom_config(domain, domains[domain])
+            for domain in diff["domains"]["update"]:
+                db.update_domain_custom_config(domain, domains[domain])
+            results = db.add_routes(new_routes)
+            for route in updated_routes:
+                db.update_route(route.id, route)
+        stats["errors"].extend({"route": f"{route.domain}{route.path}", "error": error} for route, (_, error) in zip(new_routes, results) if error)
+    changed_domains = set(diff["domains"]["add"]) | set(diff["domains"]["update"]) | {route.domain for route in new_routes + updated_routes}
+    return {"dry_run": dry_run, "stats": stats, "diff": diff, "domains": sorted(changed_domains)}
+
+if __name__ == "__main__":
+    from database import Database
+    from schema import Config
+    if len(sys.argv) < 2:
+        print("Usage: python nginx_importer.py <path> [--apply]")
+        sys.exit(1)
+    config = Config.load_from_yaml("config.yaml")
+    result = import_nginx_config(sys.argv[1], Database(), config.nginx.config_warn_message, dry_run="--apply" not in sys.argv,
+                                 static_root=config.nginx.static_path)
+    print(json.dumps(result, indent=2))
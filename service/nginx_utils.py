@@ -1,5 +1,39 @@
-from schema import Config, NginxRoute
-from nginx_config import generate_route_config, generate_config_file, config_lines
+import hashlib
+import io
+import os
+import threading
+from schema import Config, NginxRoute, UpstreamMode
+from nginx_config import generate_route_config, get_route_policy, write_cache_zones, write_config_file, write_upstreams_file, config_lines
+from config_writer import ConfigWriter
+from metrics import FILES_WRITTEN, NGINX_CONFIG_SECONDS, ROUTES_RENDERED
+
+class DirtyDomainTracker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._domains = set()
+        # Nothing has been rendered by this process yet, so every domain is dirty
+        self._all = True
+
+    def mark(self, *domains: str):
+        with self._lock:
+            self._domains.update(domain for domain in domains if domain)
+
+    def mark_all(self):
+        with self._lock:
+            self._all = True
+
+    def pop(self):
+        with self._lock:
+            dirty = (self._all, self._domains)
+            self._all = False
+            self._domains = set()
+            return dirty
+
+    def restore(self, all_domains: bool, domains: set[str]):
+        with self._lock:
+            self._all = self._all or all_domains
+            self._domains.update(domains)
+
 class NginxUtils:
     def __init__(self, config: Config):
         self.static_path = config.nginx.static_path
@@ -10,17 +44,102 @@ class NginxUtils:
         self.private_key_path = config.nginx.private_key_path
         self.certificate_path = config.nginx.certificate_path
         self.letsencrypt_path = config.nginx.letsencrypt_path
+        self.upstream_mode = config.nginx.upstream_mode
+        self.resolver = f"{config.nginx.resolver} valid={config.nginx.resolver_valid}"
+        self.upstream_keepalive = config.nginx.upstream_keepalive
+        self.shared_config_file = config.nginx.shared_config_file
+        self.cache_path = config.nginx.cache_path
+        self.cache_keys_size = config.nginx.cache_keys_size
+        self.cache_max_size = config.nginx.cache_max_size
+        self.cache_inactive = config.nginx.cache_inactive
+        self.dirty_domains = DirtyDomainTracker()
+        self.config_hashes = {}
+        self.reload_pending = False
+        self.writer = ConfigWriter(self.config_path)
+        self._staged = {}
+        self._committed = {}
 
-    def update_nginx_config(self, domain: str, domain_config: str, routes: list[NginxRoute]):
-        routes_config = [generate_route_config(route.path, route.container_id, route.port, route.custom_config, route.target_path) if route.enabled else '' for route in routes]
-        config_data = generate_config_file(server_config=domain_config, routes_config=routes_config, warn_message=self.config_warn_message)
+    def get_config_file_path(self, domain: str):
         if domain == "default":
-            config_file_path = self.config_path + self.docker_config_file
-        else:
-            config_file_path = self.config_path + '.'.join(domain.split(".")[:-1]) + ".conf"
-        with open(config_file_path, "w") as f:
-            f.write(config_data)
-        print(config_file_path)
+            return self.config_path + self.docker_config_file
+        return self.config_path + '.'.join(domain.split(".")[:-1]) + ".conf"
+
+    def _get_file_hash(self, config_file_path: str):
+        if config_file_path not in self.config_hashes:
+            if not os.path.exists(config_file_path):
+                return None
+            with open(config_file_path, "rb") as f:
+                self.config_hashes[config_file_path] = hashlib.sha256(f.read()).hexdigest()
+        return self.config_hashes[config_file_path]
+
+    def update_nginx_config(self, domain: str, domain_config: str, routes: list[NginxRoute]):
+        # Stages the file for commit_config(), returns None when the file on disk already has the rendered content
+        with NGINX_CONFIG_SECONDS.time(operation="render"):
+            buffer = io.StringIO()
+            write_config_file(buffer, server_config=domain_config, routes=routes, warn_message=self.config_warn_message,
+                              upstream_mode=self.upstream_mode, resolver=self.resolver, static_root=self.static_path)
+            config_data = buffer.getvalue()
+        ROUTES_RENDERED.inc(sum(1 for route in routes if route.enabled))
+        return self._stage_config(self.get_config_file_path(domain), config_data, domain)
+
+    def update_shared_config(self, routes: list[NginxRoute], replicas: dict[str, list[str]] = {}):
+        # The cache zones and upstreams are shared by every domain, so the file is rendered from all the routes on every push
+        with NGINX_CONFIG_SECONDS.time(operation="render"):
+            buffer = io.StringIO()
+            buffer.write(self.config_warn_message + "\n")
+            write_cache_zones(buffer, routes, self.cache_path, self.cache_keys_size, self.cache_max_size, self.cache_inactive)
+            if self.upstream_mode == UpstreamMode.upstream:
+                write_upstreams_file(buffer, routes, self.upstream_keepalive, replicas)
+            config_data = buffer.getvalue()
+        return self._stage_config(self.config_path + self.shared_config_file, config_data, None)
+
+    def remove_nginx_config(self, domain: str):
+        # Stages the removal of the file of a domain without routes, returns None when there is no file
+        config_file_path = self.get_config_file_path(domain)
+        if not os.path.exists(config_file_path):
+            return None
+        self.writer.stage_removal(config_file_path)
+        self._staged[config_file_path] = (domain, None)
+        return config_file_path
+
+    def _stage_config(self, config_file_path: str, config_data: str, domain: str | None):
+        config_hash = hashlib.sha256(config_data.encode()).hexdigest()
+        if self._get_file_hash(config_file_path) == config_hash:
+            return None
+        with NGINX_CONFIG_SECONDS.time(operation="stage"):
+            self.writer.stage(config_file_path, config_data)
+        self._staged[config_file_path] = (domain, config_hash)
+        return config_file_path
+
+    def commit_config(self):
+        with NGINX_CONFIG_SECONDS.time(operation="commit"):
+            files = self.writer.commit()
+        FILES_WRITTEN.inc(len(files))
+        for config_file_path in files:
+            config_hash = self._staged[config_file_path][1]
+            if config_hash:
+                self.config_hashes[config_file_path] = config_hash
+            else:
+                self.config_hashes.pop(config_file_path, None)
+            print(config_file_path)
+        self.reload_pending = self.reload_pending or bool(files)
+        self._committed = {path: self._staged[path][0] for path in files}
+        self._staged = {}
+        return files
+
+    def discard_config(self):
+        self.writer.discard()
+        self._staged = {}
+
+    def rollback_config(self):
+        # Puts back the files replaced by the last commit, their domains stay dirty for the next push
+        files = self.writer.rollback()
+        for config_file_path in files:
+            self.config_hashes.pop(config_file_path, None)
+        self.dirty_domains.mark(*[self._committed[path] for path in files])
+        self.reload_pending = False
+        self._committed = {}
+        return files
 
     def get_ssl_certificate_route(self, path: str):
         return self.letsencrypt_path + path + "/fullchain.pem"
@@ -29,7 +148,7 @@ class NginxUtils:
         return self.letsencrypt_path + path + "/privkey.pem"
     
     def get_route_config(self, route: NginxRoute):
-        return generate_route_config(route.path, route.container_id, route.port)
+        return generate_route_config(route.path, route.container_id, route.port, route_policy=get_route_policy(route))
     
     def get_default_domain_config(self, domain: str):
         return config_lines( is_default=True if domain == "default" else False, 
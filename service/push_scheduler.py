@@ -0,0 +1,102 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable
+
+class PushScheduler:
+    # Runs at most one config push at a time. Requests that arrive while a push is waiting its delay, or while
+    # another push runs, are coalesced into the same pending job.
+    def __init__(self, push: Callable[[], dict], delay: float = 1.0, max_jobs: int = 100):
+        self.push = push
+        self.delay = delay
+        self.max_jobs = max_jobs
+        self._condition = threading.Condition()
+        self._jobs = OrderedDict()
+        self._pending = None
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="push-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def request(self):
+        with self._condition:
+            if self._pending is None:
+                job = {
+                    "id": uuid.uuid4().hex,
+                    "status": "pending",
+                    "requests": 0,
+                    "requested_at": time.time(),
+                    "started_at": None,
+                    "finished_at": None,
+                    "queued_ms": None,
+                    "duration_ms": None,
+                    "result": None,
+                    "error": None,
+                }
+                self._jobs[job["id"]] = job
+                while len(self._jobs) > self.max_jobs:
+                    self._jobs.popitem(last=False)
+                self._pending = job
+                self._condition.notify_all()
+            self._pending["requests"] += 1
+            return dict(self._pending)
+
+    def get(self, job_id: str):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id: str, timeout: float | None = None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            while self._jobs.get(job_id, {}).get("status") in ("pending", "running"):
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                # Leave the window open for more requests before taking the job
+                job = self._pending
+                while not self._stopped:
+                    remaining = job["requested_at"] + self.delay - time.time()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._stopped:
+                    return
+                self._pending = None
+                job["status"] = "running"
+                job["started_at"] = time.time()
+                job["queued_ms"] = (job["started_at"] - job["requested_at"]) * 1000
+            start = time.perf_counter()
+            try:
+                result, status, error = self.push(), "done", None
+            except Exception as e:
+                print(f"Error pushing nginx config: {e}")
+                result, status, error = None, "failed", str(e)
+            with self._condition:
+                job["duration_ms"] = (time.perf_counter() - start) * 1000
+                job["finished_at"] = time.time()
+                job["result"] = result
+                job["status"] = status
+                job["error"] = error
+                self._condition.notify_all()
@@ -1,10 +1,19 @@
 from enum import Enum
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import yaml
 class ProxyType(str, Enum):
     docker = "docker"
     static = "static"
 
+class ReloadMode(str, Enum):
+    restart = "restart"
+    reload = "reload"
+
+class UpstreamMode(str, Enum):
+    direct = "direct"
+    upstream = "upstream"
+    resolver = "resolver"
+
 class NginxRoute(BaseModel):
     proxy_type: ProxyType
     domain: str = ""
@@ -19,12 +28,37 @@ class NginxRoute(BaseModel):
     custom_config: str | None = None
     project_name: str | None = None
     contact_user: str | None = None
+    # Caching and compression policy, None leaves the nginx defaults. They are written into the location as they are,
+    # so they only accept the characters nginx needs for them
+    cache_zone: str | None = Field(default=None, pattern=r"^[A-Za-z0-9_]+$")
+    cache_ttl: str | None = Field(default=None, pattern=r"^[0-9]+[smhdwMy]?$")
+    gzip: bool | None = None
+    brotli: bool | None = None
+    expires: str | None = Field(default=None, pattern=r"^[A-Za-z0-9@+ -]+$")
+    proxy_buffering: bool | None = None
 class NginxRouteCreated(NginxRoute):
     id: int
 
 class DockerConfig(BaseModel):
     base_url: str
     network: str
+    max_workers: int = 8
+    max_connections: int = 10
+    timeout: float = 30.0
+    watch_events: bool = True
+    events_auto_push: bool = False
+    events_push_delay: float = 5.0
+
+class NginxNode(BaseModel):
+    name: str
+    # Docker engine of the node and the nginx container running in it
+    base_url: str
+    container_id: str = "nginx"
+    # Folder of the nginx container where the config files are copied, it must be included by its nginx.conf
+    config_path: str = "/etc/nginx/conf.d/"
+    # Seconds the whole push to the node may take: copying the files, testing and reloading nginx
+    timeout: float = 30.0
+    max_connections: int = 4
 
 class NginxConfig(BaseModel):
     container_id: str
@@ -35,10 +69,39 @@ class NginxConfig(BaseModel):
     private_key_path: str
     certificate_path: str
     letsencrypt_path: str
+    reload_mode: ReloadMode = ReloadMode.reload
+    push_delay: float = 1.0
+    upstream_mode: UpstreamMode = UpstreamMode.direct
+    upstream_keepalive: int = 32
+    upstream_replicas: bool = False
+    shared_config_file: str = "pruminx_shared.conf"
+    resolver: str = "127.0.0.11"
+    resolver_valid: str = "10s"
+    # proxy_cache_path of every cache_zone used by the routes, declared once in shared_config_file
+    cache_path: str = "/var/cache/nginx/pruminx/"
+    cache_keys_size: str = "10m"
+    cache_max_size: str = "1g"
+    cache_inactive: str = "60m"
+    # Folder with existing nginx config files the API can import, besides config_path
+    import_path: str = ""
+    # Edge nodes receiving every generation instead of container_id, empty keeps the single local container
+    nodes: list[NginxNode] = []
+
+class HealthConfig(BaseModel):
+    enabled: bool = False
+    interval: float = 30.0
+    timeout: float = 5.0
+    max_concurrency: int = 20
+    # Probes kept per route for the latency percentiles and the availability
+    samples: int = 100
+    # Failed probes in a row that disable a route (and successes that enable it again), 0 never disables them
+    failure_threshold: int = 0
+    auto_push: bool = False
 
 class Config(BaseModel):
     docker: DockerConfig
     nginx: NginxConfig
+    health: HealthConfig = HealthConfig()
 
     @classmethod
     def load_from_yaml(cls, file_path: str) -> 'Config':
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# The service modules import each other by name, as they do when running from the service folder. The fake
+# docker engine of the benchmarks is shared by the tests
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "service"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+def import_main(directory: str):
+    # main opens nginx_routes.db in the cwd when imported, it is opened in a temporary directory instead
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        import main
+    finally:
+        os.chdir(cwd)
+    return main
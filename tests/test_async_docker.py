@@ -0,0 +1,67 @@
+import asyncio
+import struct
+import unittest
+import docker
+from pipeline_benchmark import NGINX_CONTAINER, FakeDockerEngine
+from async_docker import AsyncDockerClient
+
+class AsyncDockerClientTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = FakeDockerEngine(["app"])
+        self.engine.start()
+
+    def tearDown(self):
+        self.engine.stop()
+
+    def _run(self, call, max_connections: int = 10):
+        async def run():
+            client = AsyncDockerClient(self.engine.base_url, max_connections=max_connections, timeout=10)
+            try:
+                return await call(client)
+            finally:
+                await client.aclose()
+        return asyncio.run(run())
+
+    def test_list_and_inspect_containers(self):
+        containers = self._run(lambda client: client.list_containers())
+        self.assertEqual(sorted(name for container in containers for name in container["Names"]), ["/app", "/" + NGINX_CONTAINER])
+        container = self._run(lambda client: client.inspect_container("app"))
+        self.assertEqual(container["Name"], "/app")
+        self.assertEqual(container["State"]["Status"], "running")
+
+    def test_missing_container_raises_not_found(self):
+        with self.assertRaises(docker.errors.NotFound):
+            self._run(lambda client: client.inspect_container("missing"))
+
+    def test_exec_run_demultiplexes_the_output(self):
+        exit_code, output = self._run(lambda client: client.exec_run(NGINX_CONTAINER, ["nginx", "-t"]))
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(output, b"nginx: configuration file /etc/nginx/nginx.conf test is successful\n")
+        self.engine.nginx_test_exit_code = 1
+        exit_code, _ = self._run(lambda client: client.exec_run(NGINX_CONTAINER, ["nginx", "-t"]))
+        self.assertEqual(exit_code, 1)
+
+    def test_demultiplex_joins_frames_and_drops_incomplete_headers(self):
+        raw = struct.pack(">BxxxI", 1, 3) + b"out" + struct.pack(">BxxxI", 2, 4) + b"err\n" + b"\x01\x00"
+        self.assertEqual(AsyncDockerClient._demultiplex(raw), b"outerr\n")
+
+    def test_semaphore_limits_concurrent_calls(self):
+        self.engine.latency = 0.1
+
+        async def call(client: AsyncDockerClient):
+            await asyncio.gather(*[client.inspect_container("app") for _ in range(8)])
+        self._run(call, max_connections=2)
+        self.assertEqual(self.engine.max_in_flight, 2)
+
+    def test_connection_errors_raise_docker_exception(self):
+        async def run():
+            client = AsyncDockerClient("tcp://127.0.0.1:1", timeout=5)
+            try:
+                await client.list_containers()
+            finally:
+                await client.aclose()
+        with self.assertRaises(docker.errors.DockerException):
+            asyncio.run(run())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from config_writer import ConfigWriter
+
+class ConfigWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.config_path = self.directory.name + "/"
+        self.files = [self.config_path + name for name in ("a.conf", "b.conf", "c.conf")]
+        for path in self.files[:2]:
+            self._write(path, "old")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @staticmethod
+    def _write(path: str, data: str):
+        with open(path, "w") as f:
+            f.write(data)
+
+    def _contents(self):
+        contents = {}
+        for path in self.files:
+            if os.path.exists(path):
+                with open(path) as f:
+                    contents[os.path.basename(path)] = f.read()
+        return contents
+
+    def _stage_all(self, writer: ConfigWriter):
+        for path in self.files:
+            writer.stage(path, "new")
+
+    def test_commit_and_rollback(self):
+        writer = ConfigWriter(self.config_path)
+        self._stage_all(writer)
+        self.assertEqual(sorted(writer.commit()), self.files)
+        self.assertEqual(self._contents(), {"a.conf": "new", "b.conf": "new", "c.conf": "new"})
+        writer.rollback()
+        self.assertEqual(self._contents(), {"a.conf": "old", "b.conf": "old"})
+
+    def test_removal_and_rollback(self):
+        writer = ConfigWriter(self.config_path)
+        writer.stage_removal(self.files[0])
+        writer.stage(self.files[1], "new")
+        self.assertEqual(sorted(writer.commit()), self.files[:2])
+        self.assertEqual(self._contents(), {"b.conf": "new"})
+        writer.rollback()
+        self.assertEqual(self._contents(), {"a.conf": "old", "b.conf": "old"})
+
+    def test_failed_rename_restores_the_previous_generation(self):
+        writer = ConfigWriter(self.config_path)
+        self._stage_all(writer)
+        replace = os.replace
+        calls = []
+
+        def failing_replace(source, destination):
+            calls.append(destination)
+            if len(calls) == 2:
+                raise OSError("disk full")
+            return replace(source, destination)
+
+        with mock.patch("config_writer.os.replace", failing_replace):
+            with self.assertRaises(OSError):
+                writer.commit()
+        self.assertEqual(self._contents(), {"a.conf": "old", "b.conf": "old"})
+        self.assertFalse(os.path.exists(writer.journal_path))
+
+    def test_interrupted_commit_is_rolled_back_on_start(self):
+        writer = ConfigWriter(self.config_path)
+        self._stage_all(writer)
+        replace = os.replace
+
+        def crash(source, destination):
+            replace(source, destination)
+            raise SystemExit("crash")
+
+        # The process dies after the first rename, before any cleanup
+        with mock.patch("config_writer.os.replace", crash):
+            with self.assertRaises(SystemExit):
+                writer.commit()
+        self.assertIn("new", self._contents().values())
+        ConfigWriter(self.config_path)
+        self.assertEqual(self._contents(), {"a.conf": "old", "b.conf": "old"})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+from docker_utils import DockerUtils, is_id_prefix
+
+WEB_ID = "db5e0c7a91f3" + "0" * 52
+APP_ID = "4f2a9b8c1d0e" + "1" * 52
+
+def record(container_id: str, name: str):
+    return {"id": container_id, "names": [name], "status": "running", "connected": True, "service": None}
+
+class FindContainerTest(unittest.TestCase):
+    def setUp(self):
+        web, app = record(WEB_ID, "web"), record(APP_ID, "app")
+        self.index = {WEB_ID: web, "web": web, APP_ID: app, "app": app}
+
+    def test_names_and_full_ids(self):
+        self.assertEqual(DockerUtils.find_container(self.index, "web")["id"], WEB_ID)
+        self.assertEqual(DockerUtils.find_container(self.index, APP_ID)["id"], APP_ID)
+
+    def test_abbreviated_ids(self):
+        self.assertEqual(DockerUtils.find_container(self.index, WEB_ID[:12])["id"], WEB_ID)
+        self.assertIsNone(DockerUtils.find_container(self.index, WEB_ID[:11]))
+
+    def test_missing_name_is_not_an_id_prefix(self):
+        # "db" is gone, the id of web starting with "db" must not make it the container of the route
+        self.assertIsNone(DockerUtils.find_container(self.index, "db"))
+        self.assertIsNone(DockerUtils.find_container(self.index, "db5e0c7a91f3-old"))
+        self.assertIsNone(DockerUtils.find_container(self.index, None))
+
+    def test_container_names_are_not_id_prefixes(self):
+        self.assertTrue(is_id_prefix(WEB_ID[:12], WEB_ID, {"web"}))
+        self.assertFalse(is_id_prefix(WEB_ID[:12], WEB_ID, {WEB_ID[:12]}))
+        self.assertFalse(is_id_prefix(WEB_ID[:12], None, set()))
+        self.assertFalse(is_id_prefix(WEB_ID[:12].upper(), WEB_ID, set()))
+
+if __name__ == "__main__":
+    unittest.main()
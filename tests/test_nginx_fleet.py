@@ -0,0 +1,91 @@
+import hashlib
+import tempfile
+import unittest
+from pipeline_benchmark import FakeDockerEngine
+from nginx_fleet import NginxFleet
+from schema import NginxNode
+
+class NginxFleetTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engines = [FakeDockerEngine([]), FakeDockerEngine([])]
+        for engine in self.engines:
+            engine.start()
+        self.fleet = NginxFleet([
+            NginxNode(name=f"node{index}", base_url=engine.base_url, timeout=10)
+            for index, engine in enumerate(self.engines)
+        ])
+
+    def tearDown(self):
+        for engine in self.engines:
+            engine.stop()
+        self.directory.cleanup()
+
+    def _render(self, **files: str):
+        # Writes the files of a generation and returns their hashes, as NginxUtils.config_hashes
+        hashes = {}
+        for name, data in files.items():
+            path = f"{self.directory.name}/{name}.conf"
+            with open(path, "w") as f:
+                f.write(data)
+            hashes[path] = hashlib.sha256(data.encode()).hexdigest()
+        return hashes
+
+    def test_push_sends_only_changed_files(self):
+        result = self.fleet.push(self._render(a="a1", b="b1"))
+        self.assertEqual([node["status"] for node in result["nodes"]], ["done", "done"])
+        self.assertEqual(result["failed_nodes"], [])
+        for engine in self.engines:
+            self.assertEqual(engine.files, {"a.conf": b"a1", "b.conf": b"b1"})
+        self.assertIsNone(self.fleet.push(self._render(a="a1", b="b1")))
+        result = self.fleet.push(self._render(a="a2", b="b1"))
+        self.assertEqual([node["files"] for node in result["nodes"]], [1, 1])
+
+    def test_files_removed_locally_are_removed_from_the_nodes(self):
+        self.fleet.push(self._render(a="a1", b="b1"))
+        files = self._render(a="a1")
+        result = self.fleet.push(files)
+        self.assertEqual([node["files"] for node in result["nodes"]], [1, 1])
+        for engine in self.engines:
+            self.assertEqual(engine.files, {"a.conf": b"a1"})
+        self.assertEqual([node["in_sync"] for node in self.fleet.get_status(files)], [True, True])
+
+    def test_rejecting_node_gets_its_files_back(self):
+        self.fleet.push(self._render(a="a1"))
+        self.engines[1].nginx_test_exit_code = 1
+        result = self.fleet.push(self._render(a="a2", b="b2"))
+        self.assertIs(result["valid"], False)
+        self.assertEqual(result["failed_nodes"], ["node1"])
+        self.assertEqual(self.engines[0].files, {"a.conf": b"a2", "b.conf": b"b2"})
+        self.assertEqual(self.engines[1].files, {"a.conf": b"a1"})
+        # The rejected files are sent again on the next push
+        self.engines[1].nginx_test_exit_code = 0
+        result = self.fleet.push(self._render(a="a2", b="b2"))
+        self.assertEqual([node["status"] for node in result["nodes"]], ["unchanged", "done"])
+        self.assertEqual(self.engines[1].files, {"a.conf": b"a2", "b.conf": b"b2"})
+
+    def test_unknown_files_are_downloaded_before_replacing_them(self):
+        # One file at a time, or the whole folder when there are more files than connections
+        for max_connections in (4, 1):
+            with self.subTest(max_connections=max_connections):
+                fleet = NginxFleet([NginxNode(name="node", base_url=self.engines[1].base_url, timeout=10, max_connections=max_connections)])
+                # Files the fleet never sent, like the ones left by a previous process
+                self.engines[1].files = {"a.conf": b"a0", "other.conf": b"x"}
+                self.engines[1].nginx_test_exit_code = 1
+                result = fleet.push(self._render(a="a1", b="b1"))
+                self.assertEqual(result["nodes"][0]["status"], "invalid")
+                self.assertEqual(self.engines[1].files, {"a.conf": b"a0", "other.conf": b"x"})
+
+    def test_unreachable_node_does_not_stop_the_others(self):
+        fleet = NginxFleet([
+            NginxNode(name="up", base_url=self.engines[0].base_url, timeout=10),
+            NginxNode(name="down", base_url="tcp://127.0.0.1:1", timeout=2),
+        ])
+        files = self._render(a="a1")
+        result = fleet.push(files)
+        self.assertEqual([node["status"] for node in result["nodes"]], ["done", "failed"])
+        self.assertEqual(result["failed_nodes"], ["down"])
+        self.assertEqual([node["in_sync"] for node in fleet.get_status(files)], [True, False])
+
+if __name__ == "__main__":
+    unittest.main()
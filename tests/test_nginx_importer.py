@@ -0,0 +1,69 @@
+import io
+import os
+import tempfile
+import unittest
+from nginx_config import write_config_file
+from nginx_importer import IMPORTED_FIELDS, iter_config_files, parse_file, resolve_import_path
+from schema import NginxRoute, ProxyType, UpstreamMode
+
+WARN_MESSAGE = "# Generated, do not edit"
+SERVER_CONFIG = "\n\tlisten 443 ssl ;\n\tserver_name ~^(www\\.)?example\\.com;\n"
+STATIC_ROOT = "/config/"
+
+ROUTES = [
+    NginxRoute(proxy_type=ProxyType.docker, domain="example.com", path="/api/", container_id="api", port=8000, target_path="/v1/"),
+    NginxRoute(proxy_type=ProxyType.docker, domain="example.com", path="/web/", container_id="Web.app-1", port=80,
+               custom_config="client_max_body_size 1M;", cache_zone="web", cache_ttl="10m", gzip=True, proxy_buffering=False),
+    NginxRoute(proxy_type=ProxyType.docker, domain="example.com", path="= /exact/", container_id="exact", port=81, target_path="/x/"),
+    NginxRoute(proxy_type=ProxyType.static, domain="example.com", path="/files/", static_path="site/files", expires="1d"),
+]
+
+class NginxImporterRoundTripTest(unittest.TestCase):
+    def _round_trip(self, upstream_mode: UpstreamMode):
+        buffer = io.StringIO()
+        write_config_file(buffer, SERVER_CONFIG, ROUTES, WARN_MESSAGE, upstream_mode=upstream_mode,
+                          resolver="127.0.0.11 valid=10s", static_root=STATIC_ROOT)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "example.conf")
+            with open(path, "w") as f:
+                f.write(buffer.getvalue())
+            [(domain, domain_config, routes, skipped)] = list(parse_file(path, WARN_MESSAGE, STATIC_ROOT))
+        self.assertEqual(domain, "example.com")
+        self.assertEqual(domain_config, SERVER_CONFIG)
+        self.assertEqual(skipped, 0)
+        self.assertEqual(len(routes), len(ROUTES))
+        for expected, route in zip(ROUTES, routes):
+            self.assertEqual(route.path, expected.path)
+            for field in IMPORTED_FIELDS:
+                self.assertEqual(getattr(route, field), getattr(expected, field), f"{upstream_mode.value} {expected.path} {field}")
+
+    def test_direct(self):
+        self._round_trip(UpstreamMode.direct)
+
+    def test_upstream(self):
+        self._round_trip(UpstreamMode.upstream)
+
+    def test_resolver(self):
+        self._round_trip(UpstreamMode.resolver)
+
+class ImportPathTest(unittest.TestCase):
+    def test_paths_can_not_leave_the_roots(self):
+        roots = ["/app/import/", "/app/nginx_conf/"]
+        self.assertEqual(resolve_import_path("site/*.conf", roots), "/app/import/site/*.conf")
+        self.assertEqual(resolve_import_path("/app/nginx_conf/", roots), "/app/nginx_conf")
+        self.assertIsNone(resolve_import_path("../../etc/nginx", roots))
+        self.assertIsNone(resolve_import_path("/etc/**/*.conf", roots))
+
+    def test_dot_folders_and_links_out_of_the_roots_are_skipped(self):
+        with tempfile.TemporaryDirectory() as directory, tempfile.TemporaryDirectory() as outside:
+            for path in ("a.conf", ".previous/a.conf", "site/b.conf", f"{outside}/c.conf"):
+                path = os.path.join(directory, path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                open(path, "w").close()
+            os.symlink(f"{outside}/c.conf", os.path.join(directory, "c.conf"))
+            expected = [os.path.join(directory, "a.conf"), os.path.join(directory, "site/b.conf")]
+            self.assertEqual(list(iter_config_files(directory, [directory])), expected)
+            self.assertEqual(list(iter_config_files(directory + "/**/*.conf", [directory])), expected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import tempfile
+import threading
+import time
+import unittest
+from push_scheduler import PushScheduler
+from tests import import_main
+
+class StubPush:
+    # Counts the pushes and how many run at once, each push blocks until released when hold is set
+    def __init__(self, hold: bool = False):
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.started.set()
+        self.release.wait(10)
+        with self._lock:
+            self.in_flight -= 1
+        return {"push": self.calls}
+
+class PushSchedulerTest(unittest.TestCase):
+    def _start(self, push: StubPush, delay: float = 0.0):
+        scheduler = PushScheduler(push, delay=delay)
+        scheduler.start()
+        self.addCleanup(scheduler.stop)
+        self.addCleanup(push.release.set)
+        return scheduler
+
+    def test_requests_within_the_delay_share_one_push(self):
+        push = StubPush()
+        scheduler = self._start(push, delay=0.3)
+        jobs = [scheduler.request() for _ in range(10)]
+        self.assertEqual(len({job["id"] for job in jobs}), 1)
+        job = scheduler.wait(jobs[0]["id"], 10)
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["requests"], 10)
+        self.assertEqual(job["result"], {"push": 1})
+        self.assertEqual(push.calls, 1)
+
+    def test_requests_during_a_push_become_the_next_job(self):
+        push = StubPush(hold=True)
+        scheduler = self._start(push)
+        first = scheduler.request()
+        self.assertTrue(push.started.wait(10))
+        self.assertEqual(scheduler.get(first["id"])["status"], "running")
+        second, third = scheduler.request(), scheduler.request()
+        self.assertNotEqual(second["id"], first["id"])
+        self.assertEqual(second["id"], third["id"])
+        self.assertEqual(scheduler.get(second["id"])["status"], "pending")
+        push.release.set()
+        self.assertEqual(scheduler.wait(first["id"], 10)["status"], "done")
+        job = scheduler.wait(second["id"], 10)
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["requests"], 2)
+        self.assertEqual(push.calls, 2)
+        self.assertEqual(push.max_in_flight, 1)
+
+    def test_wait_returns_the_unfinished_job_after_the_timeout(self):
+        push = StubPush(hold=True)
+        scheduler = self._start(push)
+        job = scheduler.request()
+        start = time.monotonic()
+        job = scheduler.wait(job["id"], 0.2)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertIn(job["status"], ("pending", "running"))
+        self.assertIsNone(scheduler.wait("missing", 0.1))
+        push.release.set()
+        self.assertEqual(scheduler.wait(job["id"], 10)["status"], "done")
+
+    def test_failed_push(self):
+        def push():
+            raise RuntimeError("nginx: [emerg]")
+        scheduler = PushScheduler(push, delay=0)
+        scheduler.start()
+        self.addCleanup(scheduler.stop)
+        job = scheduler.wait(scheduler.request()["id"], 10)
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["error"], "nginx: [emerg]")
+
+class UpdateNginxConfigTest(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.main = import_main(self.directory.name)
+        self.push = StubPush(hold=True)
+        self.addCleanup(self.push.release.set)
+        self.main.nginx_app.push_scheduler = PushScheduler(self.push, delay=0)
+        self.main.nginx_app.push_scheduler.start()
+        self.addCleanup(self.main.nginx_app.push_scheduler.stop)
+        # Without the lifespan, the endpoint only needs the scheduler
+        self.client = TestClient(self.main.nginx_app)
+
+    def test_wait_timeout_answers_202_with_the_job(self):
+        response = self.client.post("/update_nginx_config", params={"wait": True, "timeout": 0.2})
+        self.assertEqual(response.status_code, 202)
+        job = response.json()["job"]
+        self.assertIn(job["status"], ("pending", "running"))
+        self.push.release.set()
+        self.main.nginx_app.push_scheduler.wait(job["id"], 10)
+        response = self.client.get(f"/update_nginx_config/{job['id']}")
+        self.assertEqual(response.json()["job"]["status"], "done")
+
+if __name__ == "__main__":
+    unittest.main()
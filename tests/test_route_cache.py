@@ -0,0 +1,126 @@
+import os
+import tempfile
+import unittest
+from database import Database
+from schema import NginxRoute, ProxyType
+from tests import import_main
+
+def make_route(path: str, domain: str = "example.com", port: int = 80):
+    return NginxRoute(proxy_type=ProxyType.docker, domain=domain, path=path, container_id="app", port=port)
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.directory.name, "routes.db"))
+
+    def tearDown(self):
+        self.db.close()
+        self.directory.cleanup()
+
+class RouteCacheTest(DatabaseTestCase):
+    def _paths(self):
+        return [route.path for route in self.db.get_all_routes()]
+
+    def test_writes_after_a_cached_read_are_seen(self):
+        self.db.add_route(make_route("/a"))
+        self.assertEqual(self._paths(), ["/a"])
+        self.db.add_route(make_route("/b"))
+        self.assertEqual(self._paths(), ["/a", "/b"])
+        route = self.db.get_all_routes()[1]
+        self.db.update_route(route.id, make_route("/b", port=8080))
+        self.assertEqual(self.db.get_route(route.id).port, 8080)
+        self.assertEqual(self.db.get_routes_by_domain("example.com")[1].port, 8080)
+        self.db.delete_route(route.id)
+        self.assertIsNone(self.db.get_route(route.id))
+        self.assertEqual(self._paths(), ["/a"])
+
+    def test_reads_inside_a_transaction_see_uncommitted_rows(self):
+        self.db.add_route(make_route("/a"))
+        self.assertEqual(self._paths(), ["/a"])
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction():
+                self.db.add_route(make_route("/b"))
+                self.assertEqual(self._paths(), ["/a", "/b"])
+                route = self.db.get_all_routes()[1]
+                self.assertEqual(self.db.get_route(route.id).path, "/b")
+                raise RuntimeError("rolled back")
+        self.assertEqual(self._paths(), ["/a"])
+        self.assertIsNone(self.db.get_route(route.id))
+
+    def test_returned_routes_do_not_change_the_cache(self):
+        self.db.add_route(make_route("/a"))
+        route = self.db.get_all_routes()[0]
+        route.enabled = False
+        self.assertTrue(self.db.get_all_routes()[0].enabled)
+        self.assertTrue(self.db.get_route(route.id).enabled)
+
+class SearchRoutesTest(DatabaseTestCase):
+    def test_domain_contains_matches_any_part_ignoring_case(self):
+        for domain in ("api.example.com", "Example.org", "other.net", "ex_ample.com"):
+            self.db.add_route(make_route("/a", domain=domain))
+        routes, _ = self.db.search_routes(domain_contains="example")
+        self.assertEqual([route.domain for route in routes], ["api.example.com", "Example.org"])
+        routes, _ = self.db.search_routes(domain_contains="x_a")
+        self.assertEqual([route.domain for route in routes], ["ex_ample.com"])
+        routes, _ = self.db.search_routes(domain_prefix="example")
+        self.assertEqual(routes, [])
+
+class CachedResponseTest(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        self.directory = tempfile.TemporaryDirectory()
+        self.main = import_main(self.directory.name)
+        self.previous_db = self.main.db
+        self.main.db = Database(os.path.join(self.directory.name, "routes.db"))
+        # The generations of the new database start again, the listings of the previous test must not be used
+        self.main.response_cache["generation"] = None
+        # Without the lifespan, the listings only need the database
+        self.client = TestClient(self.main.nginx_app)
+
+    def tearDown(self):
+        self.main.db.close()
+        self.main.db = self.previous_db
+        self.directory.cleanup()
+
+    def test_unchanged_listing_is_not_modified(self):
+        self.main.db.add_route(make_route("/a"))
+        response = self.client.get("/routes")
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["etag"]
+        response = self.client.get("/routes", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["etag"], etag)
+        self.assertEqual(response.content, b"")
+
+    def test_write_changes_the_etag_and_the_rows(self):
+        self.main.db.add_route(make_route("/a"))
+        etag = self.client.get("/routes").headers["etag"]
+        self.main.db.add_route(make_route("/b"))
+        response = self.client.get("/routes", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["etag"], etag)
+        self.assertEqual([route["path"] for route in response.json()["routes"]], ["/a", "/b"])
+        response = self.client.get("/routes/example.com")
+        self.assertEqual([route["path"] for route in response.json()["routes"]], ["/a", "/b"])
+
+    def test_filtered_pages_are_not_kept(self):
+        self.main.db.add_route(make_route("/a"))
+        for index in range(5):
+            response = self.client.get("/routes", params={"q": f"search{index}", "domain": "example.com"})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.main.response_cache["responses"]), 0)
+        response = self.client.get("/routes", params={"path": "/a"}, headers={"If-None-Match": response.headers["etag"]})
+        self.assertEqual(response.status_code, 304)
+
+    def test_kept_listings_are_bounded(self):
+        self.main.db.add_route(make_route("/a"))
+        for index in range(self.main.RESPONSE_CACHE_SIZE + 10):
+            self.client.get(f"/routes/domain{index}.example.com")
+        self.client.get("/routes/example.com")
+        responses = self.main.response_cache["responses"]
+        self.assertEqual(len(responses), self.main.RESPONSE_CACHE_SIZE)
+        self.assertEqual(next(reversed(responses)), "routes/example.com")
+        self.assertNotIn("routes/domain0.example.com", responses)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -92,6 +92,33 @@ export const getAllRoutes = async () => {
   return handleResponse(response);
 };
 
+export interface RouteSearch {
+  after_id?: number;
+  limit?: number;
+  domain?: string;
+  domain_prefix?: string;
+  domain_contains?: string;
+  path?: string;
+  project_name?: string;
+  contact_user?: string;
+  enabled?: boolean;
+  proxy_type?: ProxyType;
+  q?: string;
+}
+
+// Una página de rutas filtrada en el servidor, la siguiente empieza después de next_after_id
+export const searchRoutes = async (search: RouteSearch) => {
+  const params = new URLSearchParams();
+  Object.entries(search).forEach(([key, value]) => {
+    if (value !== undefined && value !== '') {
+      params.append(key, String(value));
+    }
+  });
+  params.set('limit', String(search.limit ?? 100));
+  const response = await fetch(`${API_BASE_URL}/routes?${params}`, { headers });
+  return handleResponse(response);
+};
+
 export const registerRoute = async (route: NginxRoute) => {
   const response = await fetch(`${API_BASE_URL}/route`, {
     method: 'POST',
@@ -139,11 +166,25 @@ export const getNginxStatus = async () => {
   return handleResponse(response);
 };
 
+export const getNginxNodesStatus = async () => {
+  const response = await fetch(`${API_BASE_URL}/nginx_status/nodes`, { headers });
+  return handleResponse(response);
+};
+
+export const getRoutesHealth = async () => {
+  const response = await fetch(`${API_BASE_URL}/health/routes`, { headers });
+  return handleResponse(response);
+};
+
 export const updateNginxConfig = async () => {
-  const response = await fetch(`${API_BASE_URL}/update_nginx_config`, {
+  const response = await fetch(`${API_BASE_URL}/update_nginx_config?wait=true`, {
     method: 'POST',
     headers,
   });
+  if (response.status === 202) {
+    // La actualización sigue en curso, no se ha aplicado todavía
+    throw new Error('Nginx config update still in progress');
+  }
   return handleResponse(response);
 }; 
 
@@ -37,6 +37,17 @@ export function RouteDetails({ route, onClose, onUpdate }: RouteDetailsProps) {
     }))
   }
 
+  // Los campos de caché y compresión vacíos se envían como null para usar los valores por defecto de Nginx
+  const handlePolicyChange = (e: React.ChangeEvent<HTMLInputElement | HTMLSelectElement>) => {
+    const { name, value } = e.target
+    setFormData(prev => ({
+      ...prev,
+      [name]: value === '' ? null : e.target instanceof HTMLSelectElement ? value === 'on' : value
+    }))
+  }
+
+  const toggleValue = (value?: boolean | null) => value === true ? 'on' : value === false ? 'off' : ''
+
   return (
     <div className="fixed inset-0 bg-gray-500 bg-opacity-75 flex items-center justify-center z-50">
       <div className="bg-white rounded-lg p-6 max-w-2xl w-full max-h-[90vh] overflow-y-auto">
@@ -175,6 +186,84 @@ export function RouteDetails({ route, onClose, onUpdate }: RouteDetailsProps) {
             </Tooltip>
           )}
 
+          <div className="grid grid-cols-1 gap-4 sm:grid-cols-3">
+            <Tooltip text="Zona de caché de Nginx para las respuestas de esta ruta">
+              <Input
+                label="Cache Zone"
+                name="cache_zone"
+                value={formData.cache_zone || ''}
+                onChange={handlePolicyChange}
+                placeholder="api_cache"
+              />
+            </Tooltip>
+            <Tooltip text="Tiempo que se guardan en caché las respuestas correctas">
+              <Input
+                label="Cache TTL"
+                name="cache_ttl"
+                value={formData.cache_ttl || ''}
+                onChange={handlePolicyChange}
+                placeholder="10m"
+              />
+            </Tooltip>
+            <Tooltip text="Cabeceras Expires y Cache-Control para el navegador">
+              <Input
+                label="Expires"
+                name="expires"
+                value={formData.expires || ''}
+                onChange={handlePolicyChange}
+                placeholder="1h"
+              />
+            </Tooltip>
+          </div>
+
+          <div className="grid grid-cols-1 gap-4 sm:grid-cols-3">
+            <Tooltip text="Comprime las respuestas con gzip">
+              <label className="block text-sm font-medium leading-6 text-gray-900">
+                Gzip
+                <select
+                  name="gzip"
+                  value={toggleValue(formData.gzip)}
+                  onChange={handlePolicyChange}
+                  className="mt-2 block w-full rounded-md border-0 py-1.5 text-gray-900 ring-1 ring-inset ring-gray-300 focus:ring-2 focus:ring-inset focus:ring-indigo-600 sm:text-sm sm:leading-6"
+                >
+                  <option value="">Default</option>
+                  <option value="on">On</option>
+                  <option value="off">Off</option>
+                </select>
+              </label>
+            </Tooltip>
+            <Tooltip text="Comprime las respuestas con brotli, Nginx necesita el módulo ngx_brotli">
+              <label className="block text-sm font-medium leading-6 text-gray-900">
+                Brotli
+                <select
+                  name="brotli"
+                  value={toggleValue(formData.brotli)}
+                  onChange={handlePolicyChange}
+                  className="mt-2 block w-full rounded-md border-0 py-1.5 text-gray-900 ring-1 ring-inset ring-gray-300 focus:ring-2 focus:ring-inset focus:ring-indigo-600 sm:text-sm sm:leading-6"
+                >
+                  <option value="">Default</option>
+                  <option value="on">On</option>
+                  <option value="off">Off</option>
+                </select>
+              </label>
+            </Tooltip>
+            <Tooltip text="Desactívalo para respuestas en streaming o de larga duración">
+              <label className="block text-sm font-medium leading-6 text-gray-900">
+                Proxy Buffering
+                <select
+                  name="proxy_buffering"
+                  value={toggleValue(formData.proxy_buffering)}
+                  onChange={handlePolicyChange}
+                  className="mt-2 block w-full rounded-md border-0 py-1.5 text-gray-900 ring-1 ring-inset ring-gray-300 focus:ring-2 focus:ring-inset focus:ring-indigo-600 sm:text-sm sm:leading-6"
+                >
+                  <option value="">Default</option>
+                  <option value="on">On</option>
+                  <option value="off">Off</option>
+                </select>
+              </label>
+            </Tooltip>
+          </div>
+
           <Tooltip text="Añade configuración personalizada de Nginx. Estas líneas se añadirán directamente al bloque de location">
             <div className="font-mono">
               <Textarea
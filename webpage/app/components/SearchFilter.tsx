@@ -30,7 +30,7 @@ export function SearchFilter({ onFilterChange }: SearchFilterProps) {
         placeholder="example.com"
       />
       <Input
-        label="Filter by Path"
+        label="Filter by Path prefix"
         name="path"
         value={filters.path}
         onChange={handleChange}
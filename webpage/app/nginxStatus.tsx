@@ -1,7 +1,7 @@
 "use client"
 
 import { useEffect, useState } from 'react'
-import { getNginxStatus, updateNginxConfig } from './api'
+import { getNginxNodesStatus, getNginxStatus, getRoutesHealth, updateNginxConfig } from './api'
 import { Button, Badge } from './components/ui'
 
 interface DockerStatus {
@@ -12,6 +12,33 @@ interface DockerStatus {
   }
 }
 
+interface RouteHealth {
+  id: number;
+  domain: string;
+  path: string;
+  url: string;
+  up: boolean | null;
+  availability: number | null;
+  p50_ms: number | null;
+  p99_ms: number | null;
+  consecutive_failures: number;
+  last_error: string | null;
+}
+
+interface NginxNode {
+  name: string;
+  base_url: string;
+  in_sync: boolean;
+  state: { Status: string; Running: boolean } | null;
+  last_push: {
+    status: string;
+    files: number;
+    latency_ms: number;
+    output: string;
+    error: string | null;
+  } | null;
+}
+
 interface NginxStatusProps {
   onRestart?: () => void;
 }
@@ -20,6 +47,8 @@ export default function NginxStatus({ onRestart }: NginxStatusProps) {
   const [status, setStatus] = useState<DockerStatus | null>(null)
   const [loading, setLoading] = useState(true)
   const [updating, setUpdating] = useState(false)
+  const [health, setHealth] = useState<RouteHealth[]>([])
+  const [nodes, setNodes] = useState<NginxNode[]>([])
 
   const loadStatus = async () => {
     try {
@@ -30,17 +59,31 @@ export default function NginxStatus({ onRestart }: NginxStatusProps) {
     } finally {
       setLoading(false)
     }
+    try {
+      const data = await getRoutesHealth()
+      setHealth(data.routes)
+    } catch {
+      // Los health checks están desactivados en la configuración
+      setHealth([])
+    }
+    try {
+      const data = await getNginxNodesStatus()
+      setNodes(data.nodes)
+    } catch {
+      // No hay nodos configurados, solo el contenedor local
+      setNodes([])
+    }
   }
 
   const handleRestart = async () => {
     try {
       setUpdating(true)
       await updateNginxConfig()
-      await loadStatus() // Recargar el estado después de reiniciar
       onRestart?.() // Llamar a la función de recarga si existe
     } catch (error) {
       console.error('Error restarting nginx:', error)
     } finally {
+      await loadStatus() // Recargar el estado después de reiniciar, también si algún nodo ha fallado
       setUpdating(false)
     }
   }
@@ -49,6 +92,8 @@ export default function NginxStatus({ onRestart }: NginxStatusProps) {
     loadStatus()
   }, [])
 
+  const formatMs = (value: number | null) => value === null ? '-' : `${value.toFixed(1)} ms`
+
   if (loading) {
     return (
       <div className="text-center">
@@ -90,6 +135,68 @@ export default function NginxStatus({ onRestart }: NginxStatusProps) {
           {updating ? 'Restarting...' : 'Restart Nginx'}
         </Button>
       </div>
+      {nodes.length > 0 && (
+        <table className="min-w-full divide-y divide-gray-300">
+          <thead>
+            <tr>
+              <th className="px-3 py-2 text-left text-sm font-semibold text-gray-900">Node</th>
+              <th className="px-3 py-2 text-left text-sm font-semibold text-gray-900">Nginx</th>
+              <th className="px-3 py-2 text-left text-sm font-semibold text-gray-900">Config</th>
+              <th className="px-3 py-2 text-left text-sm font-semibold text-gray-900">Last push</th>
+            </tr>
+          </thead>
+          <tbody className="divide-y divide-gray-200">
+            {nodes.map((node) => (
+              <tr key={node.name} title={node.last_push?.error || node.last_push?.output || node.base_url}>
+                <td className="px-3 py-2 text-sm text-gray-700">{node.name}</td>
+                <td className="px-3 py-2 text-sm">
+                  <Badge variant={node.state?.Running ? 'success' : 'error'}>
+                    {node.state ? node.state.Status : 'Unreachable'}
+                  </Badge>
+                </td>
+                <td className="px-3 py-2 text-sm">
+                  <Badge variant={node.in_sync ? 'success' : 'error'}>
+                    {node.in_sync ? 'In sync' : 'Outdated'}
+                  </Badge>
+                </td>
+                <td className="px-3 py-2 text-sm text-gray-700">
+                  {node.last_push ? `${node.last_push.status} (${node.last_push.files} files, ${formatMs(node.last_push.latency_ms)})` : '-'}
+                </td>
+              </tr>
+            ))}
+          </tbody>
+        </table>
+      )}
+      {health.length > 0 && (
+        <table className="min-w-full divide-y divide-gray-300">
+          <thead>
+            <tr>
+              <th className="px-3 py-2 text-left text-sm font-semibold text-gray-900">Route</th>
+              <th className="px-3 py-2 text-left text-sm font-semibold text-gray-900">Health</th>
+              <th className="px-3 py-2 text-left text-sm font-semibold text-gray-900">Availability</th>
+              <th className="px-3 py-2 text-left text-sm font-semibold text-gray-900">p50</th>
+              <th className="px-3 py-2 text-left text-sm font-semibold text-gray-900">p99</th>
+            </tr>
+          </thead>
+          <tbody className="divide-y divide-gray-200">
+            {health.map((route) => (
+              <tr key={route.id} title={route.last_error || route.url}>
+                <td className="px-3 py-2 text-sm text-gray-700">{route.domain}{route.path}</td>
+                <td className="px-3 py-2 text-sm">
+                  <Badge variant={route.up ? 'success' : 'error'}>
+                    {route.up ? 'Up' : `Down (${route.consecutive_failures})`}
+                  </Badge>
+                </td>
+                <td className="px-3 py-2 text-sm text-gray-700">
+                  {route.availability === null ? '-' : `${(route.availability * 100).toFixed(1)}%`}
+                </td>
+                <td className="px-3 py-2 text-sm text-gray-700">{formatMs(route.p50_ms)}</td>
+                <td className="px-3 py-2 text-sm text-gray-700">{formatMs(route.p99_ms)}</td>
+              </tr>
+            ))}
+          </tbody>
+        </table>
+      )}
     </div>
   )
 }
\ No newline at end of file
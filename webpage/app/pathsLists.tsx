@@ -1,13 +1,14 @@
 "use client"
 
-import { useEffect, useState, forwardRef, useImperativeHandle, useMemo } from 'react'
-import { getAllRoutes } from './api'
+import { useEffect, useState, forwardRef, useImperativeHandle } from 'react'
+import { searchRoutes } from './api'
 import RouteRow from './components/RouteRow'
 import { SearchFilter } from './components/SearchFilter'
 import { NginxRoute } from './types'
 
 interface RoutesResponse {
   routes: NginxRoute[];
+  next_after_id: number | null;
 }
 
 interface PathsListProps {
@@ -15,13 +16,19 @@ interface PathsListProps {
 }
 
 const PathsList = forwardRef((props: PathsListProps, ref) => {
-  const [routes, setRoutes] = useState<RoutesResponse>({ routes: [] })
+  const [routes, setRoutes] = useState<RoutesResponse>({ routes: [], next_after_id: null })
   const [loading, setLoading] = useState(true)
   const [filters, setFilters] = useState({ domain: '', path: '' })
 
+  const fetchPage = (afterId?: number) => searchRoutes({
+    after_id: afterId,
+    domain_contains: filters.domain,
+    path: filters.path,
+  })
+
   const loadRoutes = async () => {
     try {
-      const data = await getAllRoutes()
+      const data = await fetchPage()
       setRoutes(data)
     } catch (error) {
       console.error('Error loading routes:', error)
@@ -30,21 +37,27 @@ const PathsList = forwardRef((props: PathsListProps, ref) => {
     }
   }
 
+  const loadMoreRoutes = async () => {
+    if (routes.next_after_id === null) return
+    try {
+      const data = await fetchPage(routes.next_after_id)
+      setRoutes({ routes: [...routes.routes, ...data.routes], next_after_id: data.next_after_id })
+    } catch (error) {
+      console.error('Error loading routes:', error)
+    }
+  }
+
   useImperativeHandle(ref, () => ({
     loadRoutes
   }))
 
+  // The filters are applied by the server, wait for the user to stop typing before asking for them
   useEffect(() => {
-    loadRoutes()
-  }, [])
+    const timeout = setTimeout(loadRoutes, 300)
+    return () => clearTimeout(timeout)
+  }, [filters])
 
-  const filteredRoutes = useMemo(() => {
-    return routes.routes.filter(route => {
-      const domainMatch = route.domain.toLowerCase().includes(filters.domain.toLowerCase())
-      const pathMatch = route.path.toLowerCase().includes(filters.path.toLowerCase())
-      return domainMatch && pathMatch
-    })
-  }, [routes.routes, filters])
+  const filteredRoutes = routes.routes
 
   if (loading) {
     return (
@@ -92,6 +105,16 @@ const PathsList = forwardRef((props: PathsListProps, ref) => {
                 )}
               </tbody>
             </table>
+            {routes.next_after_id !== null && (
+              <div className="py-4 text-center">
+                <button
+                  onClick={loadMoreRoutes}
+                  className="text-sm font-semibold text-indigo-600 hover:text-indigo-500"
+                >
+                  Load more routes
+                </button>
+              </div>
+            )}
           </div>
         </div>
       </div>
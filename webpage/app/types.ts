@@ -14,4 +14,10 @@ export interface NginxRoute {
   custom_config?: string | null;
   project_name?: string | null;
   contact_user?: string | null;
+  cache_zone?: string | null;
+  cache_ttl?: string | null;
+  gzip?: boolean | null;
+  brotli?: boolean | null;
+  expires?: string | null;
+  proxy_buffering?: boolean | null;
 } 
\ No newline at end of file